@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+class LRUCache:
+    """
+    In-memory LRU cache bounded by the total size of its values in bytes.
+    Not thread-safe: use it from the event loop only.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = len):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data: OrderedDict = OrderedDict() # key -> (value, size)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key: Hashable, value: Any, size: Optional[int] = None):
+        if size is None:
+            size = self._sizeof(value)
+        self.pop(key)
+        # Values bigger than the whole cache would just flush everything else
+        if size > self.max_bytes:
+            return
+        self._data[key] = (value, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._data.popitem(last=False)
+            self.current_bytes -= evicted_size
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        self.current_bytes -= item[1]
+        return item[0]
+
+    def clear(self):
+        self._data.clear()
+        self.current_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
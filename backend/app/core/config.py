@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "AI Chat App"
@@ -7,15 +7,141 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "your-secret-key-please-change-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7 # 7 days
+    PRINCIPAL_CACHE_TTL: float = 300.0 # Seconds a verified token skips the user lookup
+    PRINCIPAL_CACHE_MAX_ENTRIES: int = 10000
+    BCRYPT_ROUNDS: int = 12 # Existing hashes with another cost are rehashed at login
+    PASSWORD_HASH_WORKERS: int = 2 # Threads; bcrypt releases the GIL
+    PASSWORD_HASH_QUEUE_DEPTH: int = 16 # Waiting hashes before logins are turned away
     
+    # Public address of this server, used to build links to uploaded files
+    PUBLIC_BASE_URL: str = "http://localhost:8000"
+    UPLOAD_DIR: str = "uploads"
+    UPLOAD_CACHE_MAX_AGE: int = 365 * 24 * 60 * 60 # Seconds; content-addressed uploads never change
+    # Resized copies of uploaded images, served as /uploads/<file>?size=<name>
+    IMAGE_DERIVATIVE_DIR: str = "cache/derivatives"
+    IMAGE_DERIVATIVE_SIZES: Dict[str, int] = { # Longest side in pixels
+        "thumb": 160,
+        "small": 480,
+        "large": 1280,
+    }
+    IMAGE_DERIVATIVE_QUALITY: int = 80 # WebP
+
     # Database
     DATABASE_URL: str = "sqlite:///./sql_app.db"
+    DB_AUTO_MIGRATE: bool = True # Otherwise run `python -m app.db.migrations` before starting
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0 # Seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800 # Seconds; PostgreSQL only
+    SQLITE_JOURNAL_MODE: str = "WAL" # Readers no longer block the writer
+    SQLITE_SYNCHRONOUS: str = "NORMAL" # Safe with WAL; FULL fsyncs every commit
+    SQLITE_CACHE_SIZE_KB: int = 64 * 1024 # Page cache per connection
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000 # Wait this long for a lock instead of failing
     
     # AI Models
     QWEN_API_KEY: Optional[str] = None
     QWEN_BASE_URL: Optional[str] = None
     DEEPSEEK_API_KEY: Optional[str] = None
     DEEPSEEK_BASE_URL: Optional[str] = None
+    IMAGE_CACHE_BYTES: int = 64 * 1024 * 1024 # Encoded images kept for later turns
+    # Uploaded images are downscaled to the vision model's input resolution and sent as WebP without metadata
+    VISION_IMAGE_MAX_SIDE: Dict[str, int] = { # Longest side in pixels, per model
+        "qwen-vl-max": 1280,
+    }
+    VISION_IMAGE_DEFAULT_MAX_SIDE: int = 1280
+    VISION_IMAGE_QUALITY: int = 85
+    MODEL_PROVIDERS: Dict[str, str] = {} # Model -> "qwen" or "deepseek", where the name does not tell
+    MODEL_FALLBACKS: Dict[str, List[str]] = { # Tried before the first token when a provider fails
+        "qwen-plus": ["deepseek-chat"],
+        "deepseek-chat": ["qwen-plus"],
+    }
+    PROVIDER_MAX_CONCURRENCY: Dict[str, int] = {} # Requests in flight per provider
+    PROVIDER_DEFAULT_CONCURRENCY: int = 32
+    PROVIDER_ACQUIRE_TIMEOUT: float = 5.0 # Seconds to wait for a slot before trying a fallback
+    PROVIDER_FIRST_TOKEN_TIMEOUT: float = 30.0
+    PROVIDER_EWMA_ALPHA: float = 0.2 # Weight of the newest sample in latency and error averages
+    PROVIDER_BREAKER_ERRORS: int = 5 # Failures in a row that open a provider's circuit...
+    PROVIDER_BREAKER_COOLDOWN: float = 30.0 # ...for this many seconds
+
+    # Web fetching
+    WEB_FETCH_TIMEOUT: float = 10.0 # Per request
+    WEB_FETCH_DEADLINE: float = 15.0 # For all URLs in one message
+    WEB_MAX_CONNECTIONS: int = 20
+    WEB_PER_HOST_CONCURRENCY: int = 2
+    WEB_MAX_BYTES: int = 2 * 1024 * 1024 # Body bytes read per page
+    WEB_MAX_CHARS: int = 10000 # Extracted characters kept per page
+    WEB_CACHE_DIR: str = "cache/web"
+    WEB_CACHE_TTL: int = 60 * 60 # Seconds before an entry is revalidated
+    WEB_CACHE_MEMORY_BYTES: int = 32 * 1024 * 1024
+    WEB_CACHE_DISK_BYTES: int = 512 * 1024 * 1024
+
+    # Document extraction process pool
+    EXTRACTION_WORKERS: int = 2
+    EXTRACTION_QUEUE_DEPTH: int = 8 # Jobs waiting for a worker before uploads get a 503
+    EXTRACTION_TIMEOUT: float = 60.0 # Seconds per job
+    EXTRACTION_MEMORY_LIMIT_MB: int = 1024 # Per worker, where the OS supports it
+    PDF_PAGES_PER_JOB: int = 8
+    SPOOL_DIR: str = "cache/spool" # Uploads are written here while they are processed
+    UPLOAD_MAX_BYTES: int = 100 * 1024 * 1024
+    EXTRACTION_CACHE_DIR: str = "cache/extraction"
+    EXTRACTION_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+
+    # Conversation context (estimated tokens of history sent per turn)
+    CONTEXT_TOKEN_BUDGET: int = 16000
+    MODEL_CONTEXT_BUDGETS: Dict[str, int] = {
+        "qwen-plus": 32000,
+        "qwen-vl-max": 16000,
+        "deepseek-chat": 32000,
+    }
+    CONTEXT_MAX_MESSAGES: int = 100
+    CONTEXT_SUMMARY_MODEL: str = "qwen-plus"
+
+    # Assistant replies are saved while they stream and can be resumed by message id
+    STREAM_CHECKPOINT_CHARS: int = 500 # Save the partial reply after this many new characters...
+    STREAM_CHECKPOINT_SECONDS: float = 2.0 # ...or this long, whichever comes first
+    STREAM_IDLE_GRACE: float = 30.0 # Seconds without a listener before generation is cancelled
+    STREAM_RETENTION: float = 60.0 # Seconds a finished stream stays in memory for late resumes
+
+    # Attached documents: chunked, indexed per session, and only the best chunks sent per turn
+    DOCUMENT_CHUNK_TOKENS: int = 300
+    DOCUMENT_TOP_K: int = 6
+    DOCUMENT_CONTEXT_TOKENS: int = 3000
+    DOCUMENT_INDEX_CACHE_BYTES: int = 32 * 1024 * 1024
+
+    # Background jobs (titles, summaries), run below interactive chat
+    JOB_BROKER: str = "sqlite" # "sqlite" survives restarts; "memory" is for tests
+    JOB_DB_PATH: str = "cache/jobs.db"
+    JOB_WORKERS: int = 2
+    JOB_MAX_ATTEMPTS: int = 4
+    JOB_RETRY_BASE: float = 5.0 # Seconds before the first retry; doubles after each
+    JOB_POLL_INTERVAL: float = 1.0
+    JOB_LEASE_SECONDS: float = 300.0 # A job running longer is assumed lost and run again
+    JOB_FAILED_RETENTION: float = 7 * 24 * 60 * 60 # Seconds failed jobs are kept for inspection
+    JOB_DEFER_ABOVE_STREAMS: int = 4 # Hold jobs while this many replies are streaming...
+    JOB_MAX_DEFER: float = 30.0 # ...but no longer than this many seconds
+    TITLE_MAX_TOKENS: int = 20
+    SUMMARY_MAX_TOKENS: int = 800
+
+    # Exact-match cache of model replies, opt-in per endpoint
+    LLM_CACHE_ENDPOINTS: Dict[str, bool] = {
+        "chat": False, # Replies to the same history would repeat word for word
+        "title": True,
+        "summary": True,
+    }
+    LLM_CACHE_TTL: float = 24 * 60 * 60
+    LLM_CACHE_BYTES: int = 32 * 1024 * 1024
+    LLM_CACHE_REPLAY_CHUNK_CHARS: int = 16 # Cached replies are streamed in pieces this size...
+    LLM_CACHE_REPLAY_DELAY: float = 0.0 # ...with this many seconds between them
+
+    # Observability
+    LOG_LEVEL: str = "INFO"
+    METRICS_ENABLED: bool = True # Prometheus text format at /metrics
+    TRACE_REQUESTS: bool = False # Log the stage timings of every chat message
+    LOOP_LAG_INTERVAL: float = 0.5 # Seconds between event loop lag samples
+
+    # Usernames allowed to use the /admin endpoints
+    ADMIN_USERNAMES: List[str] = []
 
     class Config:
         env_file = "../.env"
@@ -0,0 +1,38 @@
+from typing import Optional
+
+# Leading bytes of common binary formats -> MIME type
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"\x7fELF", "application/x-executable"),
+]
+
+TEXT_MIME_TYPES = {"application/xhtml+xml", "application/xml", "application/json"}
+
+def sniff_mime(data: bytes) -> Optional[str]:
+    """Detect the MIME type of a binary payload from its leading bytes."""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    # "BM" alone is too common at the start of text; also require the zeroed reserved fields
+    if data[:2] == b"BM" and data[6:10] == b"\x00\x00\x00\x00":
+        return "image/bmp"
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    return None
+
+def is_text_mime(mime_type: str) -> bool:
+    mime_type = mime_type.split(";")[0].strip().lower()
+    return mime_type.startswith("text/") or mime_type in TEXT_MIME_TYPES
+
+def looks_binary(data: bytes) -> bool:
+    """Heuristic for bodies that claim to be text but are not."""
+    if sniff_mime(data) is not None:
+        return True
+    # Text in any ASCII-compatible encoding has no NUL bytes
+    return b"\x00" in data[:1024]
@@ -0,0 +1,261 @@
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Sequence
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers a cache hit up to a long model reply
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        """(suffix, label values, extra label, value) for the exposition format."""
+        for key, value in self._values.items():
+            yield "", key, "", value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(Metric):
+    """A value that goes up and down. With collect, it is read when scraped: a number, or {label values: number}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), collect: Optional[Callable] = None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.collect is None:
+            yield from super().samples()
+            return
+        try:
+            collected = self.collect()
+        except Exception as e:
+            logger.warning("Error collecting %s: %s", self.name, e)
+            return
+        if not isinstance(collected, dict):
+            collected = {(): collected}
+        for key, value in collected.items():
+            yield "", key if isinstance(key, tuple) else (key,), "", value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            # Per bucket counts (not cumulative), sum, count
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield "_bucket", key, f'le="{_format_value(bound)}"', cumulative
+            yield "_sum", key, "", total
+            yield "_count", key, "", count
+
+class Registry:
+    """
+    Process-wide metrics in the Prometheus text format. Updates are plain
+    dictionary operations, cheap enough to leave on; use them from the event
+    loop only. Per process: with several workers, scrape each one.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (), collect: Optional[Callable] = None) -> Gauge:
+        return self._register(Gauge(name, help, labelnames, collect))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "chat_stage_seconds", "Time spent in each stage of handling a chat message", ["stage"]
+)
+
+class Trace:
+    """
+    Stage timings of one request. Each stage is recorded in chat_stage_seconds;
+    with TRACE_REQUESTS the whole trace is logged as one line at the end.
+    """
+
+    def __init__(self, name: str, **fields):
+        self.name = name
+        self.fields = fields
+        self.stages: list[tuple[str, float]] = []
+        self.started = time.perf_counter()
+
+    def record(self, stage: str, seconds: float):
+        stage_seconds.observe(seconds, stage=stage)
+        self.stages.append((stage, seconds))
+
+    def log(self):
+        if not settings.TRACE_REQUESTS:
+            return
+        fields = " ".join(f"{key}={value}" for key, value in self.fields.items())
+        stages = " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in self.stages)
+        total = (time.perf_counter() - self.started) * 1000
+        logger.info("trace %s %s %s total=%.1fms", self.name, fields, stages, total)
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a stage of the current request's trace, or just in chat_stage_seconds."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        trace = current_trace.get()
+        if trace is not None:
+            trace.record(name, elapsed)
+        else:
+            stage_seconds.observe(elapsed, stage=name)
+
+http_requests = registry.counter("http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+http_seconds = registry.histogram(
+    "http_request_duration_seconds", "Time until the response starts; streamed bodies continue after", ["method", "route"]
+)
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests by route template, so label values stay bounded."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                http_seconds.observe(time.perf_counter() - started, method=scope["method"], route=_route(scope))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            http_requests.inc(method=scope["method"], route=_route(scope), status=status)
+
+def _route(scope) -> str:
+    """The matched route's template; unmatched paths share one label."""
+    template = getattr(scope.get("route"), "path", None)
+    if template is None:
+        return "unmatched"
+    # Routes of an included router may carry their template without the include prefix;
+    # the prefix is whatever the request path has in front of the template's segments
+    segments = scope["path"].split("/")
+    return "/".join(segments[:max(1, len(segments) - template.count("/"))]) + template
+
+loop_lag = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer: time blocked by synchronous work",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+loop_lag_max = registry.gauge("event_loop_lag_max_seconds", "Largest event loop lag since the last scrape")
+
+class LoopLagMonitor:
+    """Wakes every interval seconds and records how much later than that it ran."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._max = 0.0
+        # Reset on scrape, so the gauge shows the worst lag per scrape interval
+        loop_lag_max.collect = self._take_max
+
+    def _take_max(self) -> float:
+        value, self._max = self._max, 0.0
+        return value
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            loop_lag.observe(lag)
+            self._max = max(self._max, lag)
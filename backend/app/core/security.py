@@ -1,10 +1,12 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -12,6 +14,68 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+class HashingBusyError(Exception):
+    """Too many password hashes are running or waiting."""
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a few dedicated threads so it never blocks the event loop.
+    At most workers + queue_depth hashes are admitted; beyond that callers
+    get HashingBusyError at once instead of queueing behind a login burst.
+    """
+
+    def __init__(self, workers: int, queue_depth: int):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.workers + self.queue_depth:
+            self.rejected += 1
+            raise HashingBusyError("Too many sign-ins at the moment, please retry shortly")
+        self.pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+        """(valid, new hash or None). A new hash is returned when the stored one uses outdated settings."""
+        valid, new_hash = await self._run(pwd_context.verify_and_update, password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "rounds": settings.BCRYPT_ROUNDS,
+        }
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_DEPTH)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -0,0 +1,30 @@
+import re
+
+_CJK = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+IMAGE_TOKENS = 1000 # Rough cost of one image part in a multimodal message
+
+def estimate_tokens(content) -> int:
+    """Rough token count: about one per CJK character and one per four other characters."""
+    if isinstance(content, list):
+        return sum(
+            estimate_tokens(part.get("text", "")) if part.get("type") == "text" else IMAGE_TOKENS
+            for part in content
+        )
+    if not content:
+        return 1
+    cjk = len(_CJK.findall(content))
+    return cjk + (len(content) - cjk) // 4 + 1
+
+_WORD_RUN = re.compile(r'[^\W_]+')
+
+def search_bigrams(text: str) -> str:
+    """
+    Every pair of adjacent letters or digits in text, plus the last character
+    of each run, as space-separated tokens. Indexed, they let one- and
+    two-character terms be looked up without a trigram.
+    """
+    tokens = []
+    for run in _WORD_RUN.findall((text or "").lower()):
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        tokens.append(run[-1])
+    return " ".join(tokens)
@@ -1,21 +1,67 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.core.tokens import search_bigrams
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
+def async_database_url(url: str) -> str:
+    """The same database through an asyncio driver: aiosqlite for SQLite, asyncpg for PostgreSQL."""
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    if url.startswith("postgresql://") or url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    return url
+
+def engine_options(url: str) -> dict:
+    """Pool settings from the storage profile. In-memory SQLite keeps SQLAlchemy's single-connection pool."""
+    if url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith("sqlite:")):
+        return {}
+    options = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+    }
+    if not url.startswith("sqlite"):
+        # Server connections can be dropped while idle
+        options["pool_pre_ping"] = True
+        options["pool_recycle"] = settings.DB_POOL_RECYCLE
+    return options
+
+def _sqlite_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    # Negative means KiB rather than pages
+    cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.close()
+    # Called by the search index triggers of migration 7
+    dbapi_connection.create_function("search_bigrams", 1, search_bigrams, deterministic=True)
+
 # Check if using SQLite
 if "sqlite" in SQLALCHEMY_DATABASE_URL:
     connect_args = {"check_same_thread": False}
 else:
     connect_args = {}
 
+# Blocking engine for migrations and scripts; request handlers use the async one
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args=connect_args
+    SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **engine_options(SQLALCHEMY_DATABASE_URL)
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(async_database_url(SQLALCHEMY_DATABASE_URL), **engine_options(SQLALCHEMY_DATABASE_URL))
+# Objects stay usable after commit: reloading expired attributes would need another await
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+if "sqlite" in SQLALCHEMY_DATABASE_URL:
+    event.listen(engine, "connect", _sqlite_connect)
+    event.listen(async_engine.sync_engine, "connect", _sqlite_connect)
+
 Base = declarative_base()
 
 def get_db():
@@ -24,3 +70,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,239 @@
+import hashlib
+import logging
+from sqlalchemy import inspect, text
+from app.core.config import settings
+from app.db import models, database
+from app.services.blob_store import blob_store
+from app.core.tokens import estimate_tokens
+from app.services.document_service import chunk_text, reference_for, LEGACY_FILENAME
+
+logger = logging.getLogger(__name__)
+
+def _add_column(conn, table: str, column: str, ddl: str):
+    # create_all already builds fresh databases with the column
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def _0001_session_summary(conn):
+    _add_column(conn, "chat_sessions", "summary", "TEXT")
+    _add_column(conn, "chat_sessions", "summary_message_id", "INTEGER")
+
+def _0002_extract_inline_images(conn):
+    # Walk the affected rows in id order so memory stays flat on big tables
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, content FROM chat_messages WHERE id > :last_id AND content LIKE '%data:image/%' ORDER BY id LIMIT 50"
+        ), {"last_id": last_id}).fetchall()
+        if not rows:
+            break
+        for row_id, content in rows:
+            new_content = blob_store.replace_data_uris(content)
+            if new_content != content:
+                conn.execute(text("UPDATE chat_messages SET content = :content WHERE id = :id"), {"content": new_content, "id": row_id})
+            last_id = row_id
+
+LEGACY_DOCUMENT_PREFIX = "Reference Document Content:\n---\n"
+LEGACY_QUESTION_MARKER = "\n---\n\nUser Question: "
+
+def _0003_index_document_context(conn):
+    # Messages used to carry the whole attached document; index it and keep a reference instead
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT m.id, m.session_id, m.content, s.user_id FROM chat_messages m JOIN chat_sessions s ON s.id = m.session_id "
+            "WHERE m.id > :last_id AND m.content LIKE 'Reference Document Content:%' ORDER BY m.id LIMIT 50"
+        ), {"last_id": last_id}).fetchall()
+        if not rows:
+            break
+        for row_id, session_id, content, user_id in rows:
+            last_id = row_id
+            if not content.startswith(LEGACY_DOCUMENT_PREFIX) or LEGACY_QUESTION_MARKER not in content:
+                continue
+            document_text, question = content[len(LEGACY_DOCUMENT_PREFIX):].rsplit(LEGACY_QUESTION_MARKER, 1)
+            if not document_text.strip():
+                conn.execute(text("UPDATE chat_messages SET content = :content WHERE id = :id"), {"content": question, "id": row_id})
+                continue
+            chunks = chunk_text(document_text, settings.DOCUMENT_CHUNK_TOKENS)
+            costs = [estimate_tokens(chunk) for chunk in chunks]
+            document_id = conn.execute(models.Document.__table__.insert().values(
+                user_id=user_id,
+                session_id=session_id,
+                filename=LEGACY_FILENAME,
+                content_hash=hashlib.sha256(document_text.encode("utf-8")).hexdigest(),
+                token_count=sum(costs),
+            )).inserted_primary_key[0]
+            if chunks:
+                conn.execute(models.DocumentChunk.__table__.insert(), [
+                    {"document_id": document_id, "ordinal": i, "content": chunk, "token_count": cost}
+                    for i, (chunk, cost) in enumerate(zip(chunks, costs))
+                ])
+            # Same layout as new messages: text, document references, then images
+            question, images_marker, images = question.partition("\n\n![Image ")
+            conn.execute(text("UPDATE chat_messages SET content = :content WHERE id = :id"), {
+                "content": f"{question}\n\n{reference_for(LEGACY_FILENAME)}{images_marker}{images}",
+                "id": row_id,
+            })
+
+def _0004_history_indexes(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_messages_session_created ON chat_messages (session_id, created_at)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_sessions_user_updated ON chat_sessions (user_id, updated_at DESC)"))
+    if conn.dialect.name == "sqlite":
+        # Give the planner statistics for the new indexes
+        conn.execute(text("ANALYZE"))
+
+def _0005_message_status(conn):
+    _add_column(conn, "chat_messages", "status", "VARCHAR")
+
+def _0006_search_index(conn):
+    if conn.dialect.name == "postgresql":
+        # Expression indexes; PostgreSQL keeps them current on every write
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_messages_content_fts ON chat_messages USING GIN (to_tsvector('simple', coalesce(content, '')))"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_sessions_title_fts ON chat_sessions USING GIN (to_tsvector('simple', coalesce(title, '')))"))
+        return
+    # External content tables: the text stays in chat_messages / chat_sessions, the FTS tables only hold the index.
+    # Trigrams match inside words and in text without spaces, such as Chinese.
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(content, content='chat_messages', content_rowid='id', tokenize='trigram')"
+    ))
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_sessions_fts USING fts5(title, content='chat_sessions', content_rowid='id', tokenize='trigram')"
+    ))
+    # Replies are indexed once they stop streaming rather than at every checkpoint.
+    # A row must be removed with the text it was indexed with, hence the matching conditions.
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages
+        WHEN new.status IS NOT 'streaming' BEGIN
+            INSERT INTO chat_messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages
+        WHEN old.status IS NOT 'streaming' BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF content, status ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, content)
+                SELECT 'delete', old.id, old.content WHERE old.status IS NOT 'streaming';
+            INSERT INTO chat_messages_fts (rowid, content)
+                SELECT new.id, new.content WHERE new.status IS NOT 'streaming';
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_sessions_fts_insert AFTER INSERT ON chat_sessions BEGIN
+            INSERT INTO chat_sessions_fts (rowid, title) VALUES (new.id, new.title);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_sessions_fts_delete AFTER DELETE ON chat_sessions BEGIN
+            INSERT INTO chat_sessions_fts (chat_sessions_fts, rowid, title) VALUES ('delete', old.id, old.title);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_sessions_fts_update AFTER UPDATE OF title ON chat_sessions BEGIN
+            INSERT INTO chat_sessions_fts (chat_sessions_fts, rowid, title) VALUES ('delete', old.id, old.title);
+            INSERT INTO chat_sessions_fts (rowid, title) VALUES (new.id, new.title);
+        END
+    """))
+    # Existing rows, under the same rule as the triggers
+    conn.execute(text("INSERT INTO chat_messages_fts (rowid, content) SELECT id, content FROM chat_messages WHERE status IS NOT 'streaming'"))
+    conn.execute(text("INSERT INTO chat_sessions_fts (rowid, title) SELECT id, title FROM chat_sessions"))
+
+def _0007_search_bigrams(conn):
+    if conn.dialect.name != "sqlite":
+        # to_tsvector already indexes short words
+        return
+    # The trigram tables cannot look up one- or two-character terms, which are common in Chinese.
+    # These index search_bigrams() of the same text; contentless, as the text is derived.
+    conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_bigrams USING fts5(content, content='', tokenize='unicode61')"))
+    conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS chat_sessions_bigrams USING fts5(title, content='', tokenize='unicode61')"))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_bigrams_insert AFTER INSERT ON chat_messages
+        WHEN new.status IS NOT 'streaming' BEGIN
+            INSERT INTO chat_messages_bigrams (rowid, content) VALUES (new.id, search_bigrams(new.content));
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_bigrams_delete AFTER DELETE ON chat_messages
+        WHEN old.status IS NOT 'streaming' BEGIN
+            INSERT INTO chat_messages_bigrams (chat_messages_bigrams, rowid, content) VALUES ('delete', old.id, search_bigrams(old.content));
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_bigrams_update AFTER UPDATE OF content, status ON chat_messages BEGIN
+            INSERT INTO chat_messages_bigrams (chat_messages_bigrams, rowid, content)
+                SELECT 'delete', old.id, search_bigrams(old.content) WHERE old.status IS NOT 'streaming';
+            INSERT INTO chat_messages_bigrams (rowid, content)
+                SELECT new.id, search_bigrams(new.content) WHERE new.status IS NOT 'streaming';
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_sessions_bigrams_insert AFTER INSERT ON chat_sessions BEGIN
+            INSERT INTO chat_sessions_bigrams (rowid, title) VALUES (new.id, search_bigrams(new.title));
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_sessions_bigrams_delete AFTER DELETE ON chat_sessions BEGIN
+            INSERT INTO chat_sessions_bigrams (chat_sessions_bigrams, rowid, title) VALUES ('delete', old.id, search_bigrams(old.title));
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS chat_sessions_bigrams_update AFTER UPDATE OF title ON chat_sessions BEGIN
+            INSERT INTO chat_sessions_bigrams (chat_sessions_bigrams, rowid, title) VALUES ('delete', old.id, search_bigrams(old.title));
+            INSERT INTO chat_sessions_bigrams (rowid, title) VALUES (new.id, search_bigrams(new.title));
+        END
+    """))
+    conn.execute(text(
+        "INSERT INTO chat_messages_bigrams (rowid, content) SELECT id, search_bigrams(content) FROM chat_messages WHERE status IS NOT 'streaming'"
+    ))
+    conn.execute(text("INSERT INTO chat_sessions_bigrams (rowid, title) SELECT id, search_bigrams(title) FROM chat_sessions"))
+
+# (version, description, migration) in the order they must run
+MIGRATIONS = [
+    (1, "Rolling conversation summary on chat_sessions", _0001_session_summary),
+    (2, "Move inline base64 images from chat_messages to the blob store", _0002_extract_inline_images),
+    (3, "Move attached document text from chat_messages to the document index", _0003_index_document_context),
+    (4, "Composite indexes for session history and the session list", _0004_history_indexes),
+    (5, "Streaming status on chat_messages", _0005_message_status),
+    (6, "Full-text search index over messages and session titles", _0006_search_index),
+    (7, "Bigram search index for one- and two-character terms", _0007_search_bigrams),
+]
+
+def current_version(conn) -> int:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+def upgrade(engine=None):
+    """Create missing tables, then apply pending migrations one transaction at a time."""
+    engine = engine or database.engine
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        version = current_version(conn)
+    for target, description, migrate in MIGRATIONS:
+        if target <= version:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": target})
+        logger.info("Applied migration %d: %s", target, description)
+
+def status(engine=None) -> tuple[int, int]:
+    """(applied version, latest version)"""
+    engine = engine or database.engine
+    with engine.begin() as conn:
+        return current_version(conn), MIGRATIONS[-1][0]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Apply pending database migrations.")
+    parser.add_argument("--status", action="store_true", help="Only show the applied and latest versions")
+    args = parser.parse_args()
+    logging.basicConfig(level=settings.LOG_LEVEL, format="%(message)s")
+    if not args.status:
+        upgrade()
+    applied, latest = status()
+    print(f"Schema version {applied} (latest {latest})")
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, Text, DateTime
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.database import Base
@@ -25,9 +25,16 @@ class ChatSession(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
+    # Rolling summary of the messages up to and including summary_message_id
+    summary = Column(Text, nullable=True)
+    summary_message_id = Column(Integer, nullable=True)
+
+    # Session list: a user's sessions, most recently updated first
+    __table_args__ = (Index("ix_chat_sessions_user_updated", user_id, updated_at.desc()),)
 
     owner = relationship("User", back_populates="chats")
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
+    documents = relationship("Document", back_populates="session", cascade="all, delete-orphan")
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
@@ -37,6 +44,37 @@ class ChatMessage(Base):
     role = Column(String) # user, assistant, system
     content = Column(Text)
     model = Column(String, nullable=True)
+    # Assistant replies: streaming, complete, cancelled or failed. NULL for older rows.
+    status = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    # History of a session in order
+    __table_args__ = (Index("ix_chat_messages_session_created", session_id, created_at),)
+
     session = relationship("ChatSession", back_populates="messages")
+
+class Document(Base):
+    __tablename__ = "documents"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    # Unset until the document is first sent with a message
+    session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=True, index=True)
+    filename = Column(String)
+    content_hash = Column(String, index=True) # SHA-256 of the extracted text
+    token_count = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    session = relationship("ChatSession", back_populates="documents")
+    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan", order_by="DocumentChunk.ordinal")
+
+class DocumentChunk(Base):
+    __tablename__ = "document_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    ordinal = Column(Integer) # Position in the document
+    content = Column(Text)
+    token_count = Column(Integer, default=0)
+
+    document = relationship("Document", back_populates="chunks")
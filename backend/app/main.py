@@ -1,19 +1,53 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse
+from app.core import security
 from app.core.config import settings
-from app.routers import auth, chat
-from app.db import models, database
+from app.core.metrics import registry, LoopLagMonitor, MetricsMiddleware
+from app.routers import auth, chat, admin, uploads
+from app.db import database, migrations
+from app.services.web_service import web_service
+from app.services.extraction_pool import extraction_pool
+from app.services.stream_registry import stream_registry
+from app.services.job_queue import job_queue
+from app.services.context_service import context_service
+from app.services.title_service import title_service
+from contextlib import asynccontextmanager
+import asyncio
+import logging
 import os
 
-# Create tables
-models.Base.metadata.create_all(bind=database.engine)
+logging.basicConfig(level=settings.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
-app = FastAPI(title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json")
+loop_lag_monitor = LoopLagMonitor(settings.LOOP_LAG_INTERVAL)
+
+# Background jobs, by kind; each handler takes the job payload as keyword arguments
+job_queue.register("title", title_service.from_first_message)
+job_queue.register("session_title", title_service.from_conversation)
+job_queue.register("summary", context_service.refresh_summary)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.DB_AUTO_MIGRATE:
+        # Create tables and apply pending migrations
+        await asyncio.to_thread(migrations.upgrade, database.engine)
+    await web_service.start()
+    extraction_pool.start()
+    job_queue.start()
+    loop_lag_monitor.start()
+    yield
+    await loop_lag_monitor.close()
+    await stream_registry.close()
+    await job_queue.close()
+    extraction_pool.close()
+    await web_service.close()
+    await database.async_engine.dispose()
+    security.password_hasher.close()
+
+app = FastAPI(title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json", lifespan=lifespan)
 
 # Create uploads directory if not exists
-os.makedirs("uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 
 # CORS
 origins = [
@@ -29,10 +63,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the browser read the ids needed to resume a reply
+    expose_headers=["X-Message-Id", "X-Stream-Status"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
 app.include_router(chat.router, prefix=f"{settings.API_V1_STR}/chat", tags=["chat"])
+app.include_router(admin.router, prefix=f"{settings.API_V1_STR}/admin", tags=["admin"])
+# Uploaded files and resized images, outside the API prefix so stored URLs stay valid
+app.include_router(uploads.router, prefix="/uploads", tags=["uploads"])
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def root():
@@ -0,0 +1,81 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException
+from app.core import security
+from app.routers import deps
+from app.services.principal_cache import principal_cache, Principal
+from app.services.chat_service import chat_service
+from app.services.extraction_cache import extraction_cache
+from app.services.extraction_pool import extraction_pool
+from app.services.image_derivatives import derivative_store
+from app.services.job_queue import job_queue
+from app.services.response_cache import response_cache
+from app.services.stream_registry import stream_registry
+from app.services.web_cache import web_cache
+
+router = APIRouter()
+
+@router.get("/cache/web")
+async def get_web_cache_stats(current_user: Principal = Depends(deps.get_current_admin)):
+    return web_cache.stats()
+
+@router.get("/cache/images")
+async def get_image_cache_stats(current_user: Principal = Depends(deps.get_current_admin)):
+    return chat_service.image_cache.stats()
+
+@router.get("/cache/derivatives")
+async def get_derivative_cache_stats(current_user: Principal = Depends(deps.get_current_admin)):
+    return await asyncio.to_thread(derivative_store.stats)
+
+@router.delete("/cache/derivatives")
+async def purge_derivative_cache(current_user: Principal = Depends(deps.get_current_admin)):
+    return {"purged": await asyncio.to_thread(derivative_store.purge)}
+
+@router.get("/cache/responses")
+async def get_response_cache_stats(current_user: Principal = Depends(deps.get_current_admin)):
+    return response_cache.stats()
+
+@router.delete("/cache/responses")
+async def clear_response_cache(current_user: Principal = Depends(deps.get_current_admin)):
+    purged = len(response_cache.entries)
+    response_cache.clear()
+    return {"purged": purged}
+
+@router.get("/cache/principals")
+async def get_principal_cache_stats(current_user: Principal = Depends(deps.get_current_admin)):
+    return principal_cache.stats()
+
+@router.get("/password-hashing")
+async def get_password_hashing_stats(current_user: Principal = Depends(deps.get_current_admin)):
+    return security.password_hasher.stats()
+
+@router.get("/providers")
+async def get_provider_stats(current_user: Principal = Depends(deps.get_current_admin)):
+    return chat_service.router.stats()
+
+@router.get("/streams")
+async def get_stream_stats(current_user: Principal = Depends(deps.get_current_admin)):
+    return stream_registry.stats()
+
+@router.get("/jobs")
+async def get_job_stats(current_user: Principal = Depends(deps.get_current_admin)):
+    return await job_queue.stats()
+
+@router.get("/extraction")
+async def get_extraction_stats(current_user: Principal = Depends(deps.get_current_admin)):
+    return extraction_pool.stats()
+
+@router.get("/cache/extraction")
+async def get_extraction_cache(limit: int = 100, current_user: Principal = Depends(deps.get_current_admin)):
+    stats = await asyncio.to_thread(extraction_cache.stats)
+    entries = await asyncio.to_thread(extraction_cache.entries, limit)
+    return {**stats, "recent": entries}
+
+@router.delete("/cache/extraction")
+async def purge_extraction_cache(current_user: Principal = Depends(deps.get_current_admin)):
+    return {"purged": await asyncio.to_thread(extraction_cache.purge)}
+
+@router.delete("/cache/extraction/{key}")
+async def delete_extraction_cache_entry(key: str, current_user: Principal = Depends(deps.get_current_admin)):
+    if not await asyncio.to_thread(extraction_cache.delete, key):
+        raise HTTPException(status_code=404, detail="Cache entry not found")
+    return {"purged": 1}
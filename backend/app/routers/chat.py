@@ -1,119 +1,305 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from typing import List
+from starlette.background import BackgroundTask
+from sqlalchemy import select, func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Optional
 from app.core import security
+from app.core.metrics import Trace, current_trace, stage
 from app.db import models
 from app.schemas import chat as chat_schemas
 from app.routers import deps
+from app.services.principal_cache import Principal
 from app.services.chat_service import chat_service
+from app.services.context_service import context_service
+from app.services.document_service import document_service, reference_for, LEGACY_FILENAME
 from app.services import file_service
 from app.services.web_service import web_service
+from app.services.blob_store import blob_store, DATA_URI_PATTERN
+from app.services.extraction_pool import extraction_pool, ExtractionBusyError
+from app.services.search_service import search_service, SearchQueryError
+from app.services.stream_registry import stream_registry
+from app.services.job_queue import job_queue, PRIORITY_USER, PRIORITY_DEFAULT, PRIORITY_LOW
+from app.services.title_service import DEFAULT_TITLE
 from fastapi import UploadFile, File
 from datetime import datetime
+import asyncio
+import base64
+import json
+import re
 
 router = APIRouter()
 
-async def generate_title_background(session_id: int, content: str):
-    db = deps.database.SessionLocal()
+PREVIEW_CHARS = 100 # Of the last message, in the session list
+IMAGE_MARKDOWN = re.compile(r'!\[([^\]]*)\]\((?:[^)\s]+)\)')
+
+async def _get_session(db: AsyncSession, session_id: int, user_id: int, with_messages: bool = False):
+    """The user's session, or None. with_messages loads them for the ChatSession response model."""
+    query = select(models.ChatSession).where(models.ChatSession.id == session_id, models.ChatSession.user_id == user_id)
+    if with_messages:
+        # populate_existing also reloads columns the database changed, such as updated_at
+        query = query.options(selectinload(models.ChatSession.messages)).execution_options(populate_existing=True)
+    return await db.scalar(query)
+
+async def _spool(file: UploadFile) -> tuple[str, str]:
     try:
-        # Check if title is still default
-        session = db.query(models.ChatSession).filter(models.ChatSession.id == session_id).first()
-        if not session or session.title != "New Chat":
-            return
-
-        prompt = f"Summarize the following user input into a short, concise title (max 5 words). Do not use quotes. Input: {content[:200]}"
-        
-        # We need to collect the response from the stream
-        generator = chat_service.chat_completion_stream([{"role": "user", "content": prompt}], model="qwen-plus")
-        title = ""
-        async for chunk in generator:
-            title += chunk
-            
-        title = title.strip().strip('"').strip("'")
-        if title:
-            session.title = title
-            db.commit()
-    except Exception as e:
-        print(f"Error auto-generating title: {e}")
-    finally:
-        db.close()
+        return await file_service.spool_upload(file)
+    except file_service.UploadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+def _busy(e: ExtractionBusyError) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "5"})
+
+async def _with_document(events, user_id: int, filename: str):
+    """Pass extraction events through, indexing the text and adding its document_id to "done"."""
+    pages = {}
+    async for event in events:
+        if event["type"] == "page":
+            pages[event["page"]] = event["text"]
+        elif event["type"] == "done":
+            text = "".join(pages[page] for page in sorted(pages))
+            if text.strip():
+                async with deps.database.AsyncSessionLocal() as db:
+                    document = await document_service.add_document(db, user_id, filename, text)
+                event = {**event, "document_id": document.id}
+        yield event
 
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...), current_user: models.User = Depends(deps.get_current_user)):
-    content = await file.read()
-    result = await file_service.process_file(content, file.filename)
+async def upload_file(file: UploadFile = File(...), db: AsyncSession = Depends(deps.get_db), current_user: Principal = Depends(deps.get_current_user)):
+    path, digest = await _spool(file)
+    try:
+        result = await file_service.process_file(path, file.filename, digest)
+    except ExtractionBusyError as e:
+        raise _busy(e)
+    finally:
+        file_service.remove_spooled(path)
+    # Send document_id with the next message; "text" stays for older clients
+    if result.get("text", "").strip():
+        document = await document_service.add_document(db, current_user.id, file.filename, result["text"])
+        result["document_id"] = document.id
     return {"filename": file.filename, "result": result}
 
+@router.post("/upload/stream")
+async def upload_file_stream(file: UploadFile = File(...), current_user: Principal = Depends(deps.get_current_user)):
+    """
+    Like /upload, but streams newline-delimited JSON events (start, page,
+    progress, done or error) so the client can use pages as they arrive.
+    The "done" event carries the document_id of the indexed text.
+    """
+    path, digest = await _spool(file)
+    filename = file.filename
+    user_id = current_user.id
+
+    # Repeat uploads are answered from the cache without touching the pool
+    cached = await file_service.get_cached(filename, digest)
+    if cached is not None:
+        file_service.remove_spooled(path)
+        return StreamingResponse(
+            (json.dumps(event, ensure_ascii=False) + "\n" async for event in _with_document(file_service.replay_cached(cached), user_id, filename)),
+            media_type="application/x-ndjson",
+        )
+
+    try:
+        extraction_pool.acquire()
+    except ExtractionBusyError as e:
+        file_service.remove_spooled(path)
+        raise _busy(e)
+
+    async def event_generator():
+        try:
+            async for event in _with_document(file_service.iter_file_events(path, filename, digest), user_id, filename):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": f"Error processing file: {str(e)}"}, ensure_ascii=False) + "\n"
+
+    def cleanup():
+        # Runs once the response is over, including when the client went away
+        extraction_pool.release()
+        file_service.remove_spooled(path)
+
+    return StreamingResponse(event_generator(), media_type="application/x-ndjson", background=BackgroundTask(cleanup))
+
 
 @router.post("/sessions", response_model=chat_schemas.ChatSession)
-def create_session(session: chat_schemas.ChatSessionCreate, db: Session = Depends(deps.get_db), current_user: models.User = Depends(deps.get_current_user)):
+async def create_session(session: chat_schemas.ChatSessionCreate, db: AsyncSession = Depends(deps.get_db), current_user: Principal = Depends(deps.get_current_user)):
     db_session = models.ChatSession(**session.dict(), user_id=current_user.id)
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
-    return db_session
+    await db.commit()
+    return await _get_session(db, db_session.id, current_user.id, with_messages=True)
+
+@router.get("/sessions", response_model=List[chat_schemas.ChatSessionSummary])
+async def get_sessions(before_id: Optional[int] = None, limit: int = Query(100, ge=1, le=100), db: AsyncSession = Depends(deps.get_db), current_user: Principal = Depends(deps.get_current_user)):
+    """
+    The user's sessions, most recently updated first. For the next page pass
+    the id of the last session received as before_id.
+    """
+    Session, Message = models.ChatSession, models.ChatMessage
+    message_count = select(func.count()).where(Message.session_id == Session.id).correlate(Session).scalar_subquery()
+    last_message = select(func.substr(Message.content, 1, PREVIEW_CHARS)).where(Message.session_id == Session.id).order_by(
+        Message.created_at.desc(), Message.id.desc()
+    ).limit(1).correlate(Session).scalar_subquery()
 
-@router.get("/sessions", response_model=List[chat_schemas.ChatSession])
-def get_sessions(skip: int = 0, limit: int = 100, db: Session = Depends(deps.get_db), current_user: models.User = Depends(deps.get_current_user)):
-    sessions = db.query(models.ChatSession).filter(models.ChatSession.user_id == current_user.id).order_by(models.ChatSession.updated_at.desc()).offset(skip).limit(limit).all()
-    return sessions
+    query = select(
+        Session.id,
+        Session.title,
+        Session.updated_at,
+        message_count.label("message_count"),
+        last_message.label("last_message_preview"),
+    ).where(Session.user_id == current_user.id)
+    if before_id is not None:
+        # Compare with the stored values of the previous page's last row
+        anchor = select(Session.updated_at).where(Session.id == before_id, Session.user_id == current_user.id).scalar_subquery()
+        query = query.where(or_(Session.updated_at < anchor, and_(Session.updated_at == anchor, Session.id < before_id)))
+    rows = await db.execute(query.order_by(Session.updated_at.desc(), Session.id.desc()).limit(limit))
+
+    return [
+        {**row._mapping, "last_message_preview": " ".join(row.last_message_preview.split()) if row.last_message_preview else None}
+        for row in rows
+    ]
+
+@router.get("/search", response_model=chat_schemas.SearchPage)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0, le=1000),
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: Principal = Depends(deps.get_current_user),
+):
+    """
+    The user's messages and session titles containing every word of q, best
+    matches first. For the next page pass next_offset as offset.
+    """
+    try:
+        hits, more = await search_service.search(db, current_user.id, q, limit, offset)
+    except SearchQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return chat_schemas.SearchPage(results=hits, next_offset=offset + limit if more else None)
 
 @router.get("/sessions/{session_id}", response_model=chat_schemas.ChatSession)
-def get_session(session_id: int, db: Session = Depends(deps.get_db), current_user: models.User = Depends(deps.get_current_user)):
-    session = db.query(models.ChatSession).filter(models.ChatSession.id == session_id, models.ChatSession.user_id == current_user.id).first()
+async def get_session(session_id: int, include_messages: bool = True, db: AsyncSession = Depends(deps.get_db), current_user: Principal = Depends(deps.get_current_user)):
+    """The session with all its messages; long histories should use GET /sessions/{id}/messages."""
+    session = await _get_session(db, session_id, current_user.id, with_messages=include_messages)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    if not include_messages:
+        return chat_schemas.ChatSession(
+            id=session.id, title=session.title, user_id=session.user_id,
+            created_at=session.created_at, updated_at=session.updated_at,
+        )
     return session
 
+def _encode_cursor(message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"m{message_id}".encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        if not value.startswith("m"):
+            raise ValueError(value)
+        return int(value[1:])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _strip_images(content: str) -> str:
+    content = IMAGE_MARKDOWN.sub(lambda match: f"[{match.group(1) or 'Image'}]", content)
+    return DATA_URI_PATTERN.sub("[Image]", content)
+
+@router.get("/sessions/{session_id}/messages", response_model=chat_schemas.ChatMessagePage)
+async def get_messages(
+    session_id: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    include_images: bool = True,
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: Principal = Depends(deps.get_current_user),
+):
+    """
+    A page of a session's messages: the newest by default, or the ones just
+    before / after a cursor from an earlier page. include_images=false
+    replaces image references and inline images with a placeholder.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    if not await _get_session(db, session_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    Message = models.ChatMessage
+    query = select(Message).where(Message.session_id == session_id)
+    cursor = before or after
+    if cursor:
+        anchor_id = _decode_cursor(cursor)
+        # Compare with the stored values of the cursor's message, as the history is ordered
+        anchor = select(Message.created_at).where(Message.id == anchor_id, Message.session_id == session_id).scalar_subquery()
+        if after:
+            query = query.where(or_(Message.created_at > anchor, and_(Message.created_at == anchor, Message.id > anchor_id)))
+        else:
+            query = query.where(or_(Message.created_at < anchor, and_(Message.created_at == anchor, Message.id < anchor_id)))
+
+    # One extra row tells whether there is a further page
+    if after:
+        rows = (await db.scalars(query.order_by(Message.created_at, Message.id).limit(limit + 1))).all()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        has_older, has_newer = True, more
+    else:
+        rows = (await db.scalars(query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1))).all()
+        more = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        has_older, has_newer = more, bool(before)
+
+    messages = [chat_schemas.ChatMessage.model_validate(row) for row in rows]
+    if not include_images:
+        for message in messages:
+            message.content = _strip_images(message.content)
+    return chat_schemas.ChatMessagePage(
+        messages=messages,
+        before=_encode_cursor(rows[0].id) if rows and has_older else None,
+        after=_encode_cursor(rows[-1].id) if rows and has_newer else None,
+    )
+
 @router.patch("/sessions/{session_id}", response_model=chat_schemas.ChatSession)
-def update_session(session_id: int, session_update: chat_schemas.ChatSessionUpdate, db: Session = Depends(deps.get_db), current_user: models.User = Depends(deps.get_current_user)):
-    db_session = db.query(models.ChatSession).filter(models.ChatSession.id == session_id, models.ChatSession.user_id == current_user.id).first()
+async def update_session(session_id: int, session_update: chat_schemas.ChatSessionUpdate, db: AsyncSession = Depends(deps.get_db), current_user: Principal = Depends(deps.get_current_user)):
+    db_session = await _get_session(db, session_id, current_user.id)
     if not db_session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     db_session.title = session_update.title
-    db.commit()
-    db.refresh(db_session)
-    return db_session
+    await db.commit()
+    return await _get_session(db, session_id, current_user.id, with_messages=True)
 
-@router.post("/sessions/{session_id}/summary", response_model=chat_schemas.ChatSession)
-async def generate_session_summary(session_id: int, db: Session = Depends(deps.get_db), current_user: models.User = Depends(deps.get_current_user)):
-    db_session = db.query(models.ChatSession).filter(models.ChatSession.id == session_id, models.ChatSession.user_id == current_user.id).first()
+@router.post("/sessions/{session_id}/summary", response_model=chat_schemas.ChatSession, status_code=status.HTTP_202_ACCEPTED)
+async def generate_session_summary(session_id: int, db: AsyncSession = Depends(deps.get_db), current_user: Principal = Depends(deps.get_current_user)):
+    """Queue a new title from the conversation; poll the session for the result."""
+    db_session = await _get_session(db, session_id, current_user.id)
     if not db_session:
         raise HTTPException(status_code=404, detail="Session not found")
-        
-    # Get first few messages
-    messages = db.query(models.ChatMessage).filter(models.ChatMessage.session_id == session_id).order_by(models.ChatMessage.created_at).limit(4).all()
-    if not messages:
-        return db_session
-        
-    conversation = "\n".join([f"{msg.role}: {msg.content[:200]}" for msg in messages]) # Limit content
-    prompt = f"Summarize the following conversation into a short title (max 5 words):\n\n{conversation}"
-    
-    try:
-        # Use a default model for summary
-        # Note: chat_completion_stream returns a generator, we need to iterate
-        generator = chat_service.chat_completion_stream([{"role": "user", "content": prompt}], model="qwen-plus")
-        title = ""
-        async for chunk in generator:
-            title += chunk
-            
-        title = title.strip().strip('"').strip("'")
-        if title:
-            db_session.title = title
-            db.commit()
-            db.refresh(db_session)
-    except Exception as e:
-        print(f"Error generating summary: {e}")
-        
-    return db_session
+
+    await job_queue.enqueue("session_title", {"session_id": session_id}, priority=PRIORITY_USER, dedup_key=f"session_title:{session_id}")
+    return chat_schemas.ChatSession(
+        id=db_session.id, title=db_session.title, user_id=db_session.user_id,
+        created_at=db_session.created_at, updated_at=db_session.updated_at,
+    )
 
 @router.post("/sessions/{session_id}/messages")
-async def send_message(session_id: int, message: chat_schemas.ChatMessageCreate, background_tasks: BackgroundTasks, db: Session = Depends(deps.get_db), current_user: models.User = Depends(deps.get_current_user)):
-    session = db.query(models.ChatSession).filter(models.ChatSession.id == session_id, models.ChatSession.user_id == current_user.id).first()
+async def send_message(session_id: int, message: chat_schemas.ChatMessageCreate, db: AsyncSession = Depends(deps.get_db), current_user: Principal = Depends(deps.get_current_user)):
+    session = await _get_session(db, session_id, current_user.id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    # Stage timings; the reply task inherits the trace through its context
+    trace = Trace("send_message", session=session_id, model=message.model)
+    current_trace.set(trace)
+
+    # Base64 images go to the blob store; the message only keeps their URLs
+    image_urls = []
+    for img in message.images or []:
+        if img.startswith("data:"):
+            try:
+                img = await asyncio.to_thread(blob_store.put_data_uri, img)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        image_urls.append(img)
 
     # Construct the actual text content that includes context
     actual_text_content = message.content
@@ -122,22 +308,27 @@ async def send_message(session_id: int, message: chat_schemas.ChatMessageCreate,
     urls = web_service.extract_urls(message.content)
     if urls:
         web_context = "\n\n--- Web Search Results ---\n"
-        for url in urls:
-            content = await web_service.fetch_content(url)
+        with stage("web_fetch"):
+            fetched = await web_service.fetch_all(urls)
+        for content in fetched:
             web_context += content + "\n---\n"
         actual_text_content += web_context
 
-    if message.file_context:
-        actual_text_content = f"Reference Document Content:\n---\n{message.file_context}\n---\n\nUser Question: {actual_text_content}"
+    # Documents are indexed per session; the message only keeps a reference to them
+    document_ids = list(message.document_ids or [])
+    with stage("documents"):
+        if message.file_context:
+            document = await document_service.add_document(db, current_user.id, LEGACY_FILENAME, message.file_context)
+            document_ids.append(document.id)
+        attached = await document_service.attach(db, session, document_ids)
 
     # Auto-generate title if needed
-    if session.title == "New Chat":
+    if session.title == DEFAULT_TITLE:
         # Check if this is the first few messages
-        msg_count = db.query(models.ChatMessage).filter(models.ChatMessage.session_id == session_id).count()
-        if msg_count == 0: # This is the first message (we haven't added it yet? No, we add it below. Wait.)
-             # Logic: We add message below. So count will be 1 after commit.
-             # But here count is 0. So yes, this is the first message.
-             background_tasks.add_task(generate_title_background, session_id, message.content) # Use original content for title, not the full context prompt
+        msg_count = await db.scalar(select(func.count()).select_from(models.ChatMessage).where(models.ChatMessage.session_id == session_id))
+        if msg_count == 0: # The user message is added below, so this is the first one
+            # Use original content for title, not the full context prompt
+            await job_queue.enqueue("title", {"session_id": session_id, "content": message.content}, priority=PRIORITY_DEFAULT, dedup_key=f"title:{session_id}")
 
     # Update session timestamp
     session.updated_at = datetime.utcnow()
@@ -145,48 +336,85 @@ async def send_message(session_id: int, message: chat_schemas.ChatMessageCreate,
 
     # Save user message
     stored_content = actual_text_content
-    if message.images:
-        for idx, img in enumerate(message.images):
-            # If the image is very long (base64), we might not want to store the whole thing in the text content for display history if we parse it differently later. 
-            # But for now, let's keep it consistent.
-            stored_content += f"\n\n![Image {idx+1}]({img})"
+    if attached:
+        stored_content += "\n\n" + "\n".join(reference_for(document.filename) for document in attached)
+    for idx, img in enumerate(image_urls):
+        stored_content += f"\n\n![Image {idx+1}]({img})"
 
     user_msg = models.ChatMessage(session_id=session_id, role="user", content=stored_content, model=message.model)
     db.add(user_msg)
-    db.commit()
+    with stage("save_message"):
+        await db.commit()
 
-    # Prepare context
-    history = db.query(models.ChatMessage).filter(models.ChatMessage.session_id == session_id).order_by(models.ChatMessage.created_at).all()
-    
-    messages = []
-    for i, msg in enumerate(history):
-        # Check if this is the message we just added (the last one) and if it has an image
-        if i == len(history) - 1 and message.images and msg.id == user_msg.id:
-             content_list = [{"type": "text", "text": actual_text_content}]
-             for img in message.images:
-                 content_list.append({"type": "image_url", "image_url": {"url": img}})
-             
-             messages.append({
-                 "role": "user",
-                 "content": content_list
-             })
-        else:
-             messages.append({"role": msg.role, "content": msg.content})
-
-    async def stream_generator():
-        full_response = ""
-        async for chunk in chat_service.chat_completion_stream(messages, model=message.model):
-            full_response += chunk
-            yield chunk
-        
-        try:
-            # We need a new session because the request session might be closed or not thread safe in async generator
-            new_db = deps.database.SessionLocal()
-            assistant_msg = models.ChatMessage(session_id=session_id, role="assistant", content=full_response, model=message.model)
-            new_db.add(assistant_msg)
-            new_db.commit()
-            new_db.close()
-        except Exception as e:
-            print(f"Error saving message: {e}")
+    # Prepare context: rolling summary plus the recent turns that fit the model's budget
+    with stage("history"):
+        messages = await context_service.build_messages(db, session, message.model)
+
+    # The newest message is the one we just added. Send it with the document
+    # passages relevant to this question, and its images as image parts.
+    with stage("excerpts"):
+        excerpts = await document_service.excerpts(db, session_id, message.content)
+    if excerpts:
+        actual_text_content = f"Reference Document Content:\n---\n{excerpts}\n---\n\nUser Question: {actual_text_content}"
+    if image_urls:
+        content_list = [{"type": "text", "text": actual_text_content}]
+        for img in image_urls:
+            content_list.append({"type": "image_url", "image_url": {"url": img}})
+        messages[-1] = {"role": "user", "content": content_list}
+    elif excerpts:
+        messages[-1] = {"role": "user", "content": actual_text_content}
+
+    # The reply row exists from the start and is filled in as it streams
+    assistant_msg = models.ChatMessage(session_id=session_id, role="assistant", content="", model=message.model, status="streaming")
+    db.add(assistant_msg)
+    await db.commit()
+
+    stream = stream_registry.start(
+        assistant_msg.id,
+        session_id,
+        chat_service.chat_completion_stream(messages, model=message.model, cache="chat"),
+        # Once the reply is saved
+        on_complete=lambda: job_queue.enqueue(
+            "summary", {"session_id": session_id, "model": message.model}, priority=PRIORITY_LOW, dedup_key=f"summary:{session_id}"
+        ),
+    )
+    # Wait for the first token: until then the router can still move the request to a
+    # fallback, and a request no provider could start gets an error instead of an empty reply
+    with stage("first_token"):
+        await stream_registry.first_output(stream)
+    trace.fields["message"] = assistant_msg.id
+    trace.log()
+    if stream.status == "failed" and not stream.data:
+        await db.delete(assistant_msg)
+        await db.commit()
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Model unavailable: {stream.error}")
+    return StreamingResponse(
+        stream_registry.follow(stream),
+        media_type="text/plain",
+        headers={"X-Message-Id": str(assistant_msg.id)},
+    )
+
+@router.get("/messages/{message_id}/stream")
+async def resume_stream(message_id: int, offset: int = Query(0, ge=0), db: AsyncSession = Depends(deps.get_db), current_user: Principal = Depends(deps.get_current_user)):
+    """
+    Continue an assistant reply from offset, the number of UTF-8 bytes already
+    received. Follows the live stream while it is generating; otherwise
+    returns the rest of the saved text. X-Stream-Status tells which.
+    """
+    msg = await db.scalar(
+        select(models.ChatMessage).join(models.ChatSession).where(
+            models.ChatMessage.id == message_id, models.ChatSession.user_id == current_user.id
+        )
+    )
+    if not msg or msg.role != "assistant":
+        raise HTTPException(status_code=404, detail="Message not found")
+
+    headers = {"X-Message-Id": str(message_id)}
+    stream = stream_registry.get(message_id)
+    if stream is not None and not stream.done:
+        headers["X-Stream-Status"] = "streaming"
+        return StreamingResponse(stream_registry.follow(stream, offset, resumed=True), media_type="text/plain", headers=headers)
 
-    return StreamingResponse(stream_generator(), media_type="text/plain")
+    # Finished (saved before the stream ended), or generating in another worker: the last saved text
+    headers["X-Stream-Status"] = msg.status or "complete"
+    return StreamingResponse(iter([msg.content.encode("utf-8")[offset:]]), media_type="text/plain", headers=headers)
@@ -1,22 +1,26 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
 from app.core import security
 from app.db import models, database
 from app.schemas import user as user_schemas
+from app.services.principal_cache import principal_cache, Principal
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/auth/token")
 
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db():
+    async with database.AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> Principal:
+    # Tokens seen recently were already verified and their user loaded
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -27,10 +31,22 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = user_schemas.TokenData(username=username)
+        user_id = payload.get("uid")
+        token_data = user_schemas.TokenData(username=username, user_id=user_id if isinstance(user_id, int) else None)
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
+    if token_data.user_id is not None:
+        user = await db.get(models.User, token_data.user_id)
+    else:
+        # Tokens issued before they carried the user id
+        user = await db.scalar(select(models.User).where(models.User.username == token_data.username))
     if user is None:
         raise credentials_exception
-    return user
+    principal = Principal.from_user(user)
+    principal_cache.set(token, principal, payload.get("exp"))
+    return principal
+
+async def get_current_admin(current_user: Principal = Depends(get_current_user)):
+    if current_user.username not in settings.ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return current_user
@@ -0,0 +1,79 @@
+import asyncio
+import mimetypes
+import os
+import re
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.services.blob_store import blob_store, CONTENT_HASH_PATTERN
+from app.services.image_derivatives import derivative_store, UnsupportedImageError, DERIVATIVE_MEDIA_TYPE
+
+router = APIRouter()
+
+SAFE_FILENAME = re.compile(r'[A-Za-z0-9][A-Za-z0-9._-]*')
+# (filename, mtime, size) -> SHA-256 of files saved before uploads were content-addressed
+_digests = LRUCache(1024 * 1024, sizeof=lambda digest: len(digest) + 128)
+
+async def _digest(filename: str, stat: os.stat_result) -> str:
+    stem = os.path.splitext(filename)[0]
+    if CONTENT_HASH_PATTERN.fullmatch(stem):
+        return stem
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    digest = _digests.get(key)
+    if digest is None:
+        digest = await asyncio.to_thread(blob_store.digest_of, filename)
+        _digests.set(key, digest)
+    return digest
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+@router.api_route("/{filename}", methods=["GET", "HEAD"])
+async def get_upload(filename: str, request: Request, size: Optional[str] = None):
+    """
+    An uploaded file, or with size (a name from IMAGE_DERIVATIVE_SIZES) a
+    downscaled WebP copy of an uploaded image. Responses carry a strong ETag
+    from the content hash and may be cached for good; ranges are supported.
+    """
+    path = os.path.join(settings.UPLOAD_DIR, filename)
+    try:
+        if not SAFE_FILENAME.fullmatch(filename):
+            raise FileNotFoundError(filename)
+        stat = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    digest = await _digest(filename, stat)
+    # Names without a content hash were saved before the blob store and could in principle be replaced
+    immutable = digest == os.path.splitext(filename)[0]
+    cache_control = f"public, max-age={settings.UPLOAD_CACHE_MAX_AGE}, immutable" if immutable else "no-cache"
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    etag = f'"{digest}"'
+
+    if size is not None:
+        max_side = settings.IMAGE_DERIVATIVE_SIZES.get(size)
+        if max_side is None:
+            raise HTTPException(status_code=400, detail=f"Unknown size; use one of {', '.join(settings.IMAGE_DERIVATIVE_SIZES)}")
+        if not media_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail="Only images can be resized")
+        name = derivative_store.name_for(digest, max_side)
+        etag = f'"{name}"'
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+        try:
+            path = await asyncio.to_thread(derivative_store.get, path, digest, max_side)
+        except UnsupportedImageError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        stat = None
+        media_type = DERIVATIVE_MEDIA_TYPE
+    elif _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+    headers = {"ETag": etag, "Cache-Control": cache_control, "X-Content-Type-Options": "nosniff"}
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
@@ -9,7 +9,8 @@ class ChatMessageCreate(ChatMessageBase):
     role: Optional[str] = "user"
     model: Optional[str] = "qwen-plus" # Default model
     images: Optional[List[str]] = [] # List of Base64 or URL
-    file_context: Optional[str] = None # Extracted text from file
+    document_ids: Optional[List[int]] = [] # Documents from /upload to attach to the session
+    file_context: Optional[str] = None # Extracted text from file; older clients, indexed like an upload
 
 class ChatMessage(ChatMessageBase):
     id: int
@@ -17,6 +18,7 @@ class ChatMessage(ChatMessageBase):
     session_id: int
     created_at: datetime
     model: Optional[str] = None
+    status: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -39,3 +41,31 @@ class ChatSession(ChatSessionBase):
 
     class Config:
         from_attributes = True
+
+class ChatSessionSummary(ChatSessionBase):
+    """A session list entry, without its messages."""
+    id: int
+    updated_at: datetime
+    message_count: int
+    last_message_preview: Optional[str] = None
+
+class ChatMessagePage(BaseModel):
+    """Messages in chronological order, with cursors for the adjacent pages."""
+    messages: List[ChatMessage]
+    before: Optional[str] = None # Older messages; None at the start of the session
+    after: Optional[str] = None # Newer messages; None at the end
+
+class SearchHit(BaseModel):
+    """A message or session title matching a search."""
+    kind: str # "message" or "session"
+    id: int # Of the message, or of the session for a title match
+    session_id: int
+    session_title: str
+    role: Optional[str] = None
+    created_at: datetime
+    score: float
+    snippet: str # Escaped HTML; matches are wrapped in <mark>
+
+class SearchPage(BaseModel):
+    results: List[SearchHit]
+    next_offset: Optional[int] = None # None on the last page
@@ -0,0 +1,111 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from typing import Optional
+from app.core.config import settings
+from app.core.media import sniff_mime
+
+MIME_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/bmp": "bmp",
+}
+
+CONTENT_HASH_PATTERN = re.compile(r'[0-9a-f]{64}')
+DATA_URI_PATTERN = re.compile(r'data:(image/[a-zA-Z0-9.+-]+);base64,([A-Za-z0-9+/=]+)')
+
+class BlobStore:
+    """
+    Content-addressed file store: every blob is saved once under the SHA-256
+    of its bytes, so identical uploads share one file and one URL. Blocking
+    disk I/O; call it through asyncio.to_thread from async code.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def put(self, data: bytes, ext: Optional[str] = None) -> str:
+        """Store bytes and return the blob's filename."""
+        digest = hashlib.sha256(data).hexdigest()
+        # Trust the bytes over the caller's extension
+        ext = MIME_EXTENSIONS.get(sniff_mime(data)) or self._clean_ext(ext)
+        filename = f"{digest}.{ext}"
+        path = os.path.join(self.directory, filename)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return filename
+
+    def put_file(self, source_path: str, ext: Optional[str] = None) -> str:
+        """Store a file's contents without reading it all into memory; returns the blob's filename."""
+        sha = hashlib.sha256()
+        with open(source_path, "rb") as f:
+            head = f.read(64)
+            sha.update(head)
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        ext = MIME_EXTENSIONS.get(sniff_mime(head)) or self._clean_ext(ext)
+        filename = f"{sha.hexdigest()}.{ext}"
+        path = os.path.join(self.directory, filename)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        return filename
+
+    def digest_of(self, filename: str) -> str:
+        """SHA-256 of a stored file: its name for blobs, hashed for files saved before the blob store."""
+        stem = os.path.splitext(filename)[0]
+        if CONTENT_HASH_PATTERN.fullmatch(stem):
+            return stem
+        sha = hashlib.sha256()
+        with open(os.path.join(self.directory, filename), "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def url_for(self, filename: str) -> str:
+        return f"{settings.PUBLIC_BASE_URL}/uploads/{filename}"
+
+    def put_data_uri(self, uri: str) -> str:
+        """Store the image in a base64 data URI and return its URL."""
+        match = DATA_URI_PATTERN.fullmatch(uri.strip())
+        if not match:
+            raise ValueError("Not a base64 image data URI")
+        mime_type = match.group(1).lower()
+        # Only raster formats; SVG can carry script and would be served from our origin
+        if mime_type not in MIME_EXTENSIONS:
+            raise ValueError(f"Unsupported image type: {mime_type}")
+        try:
+            data = base64.b64decode(match.group(2), validate=True)
+        except binascii.Error as e:
+            raise ValueError(f"Invalid base64 image: {e}")
+        if sniff_mime(data) != mime_type:
+            raise ValueError(f"Image data is not {mime_type}")
+        return self.url_for(self.put(data, MIME_EXTENSIONS[mime_type]))
+
+    def replace_data_uris(self, text: str) -> str:
+        """Swap every inline base64 image in text for a reference to its blob."""
+        def replace(match):
+            try:
+                return self.put_data_uri(match.group(0))
+            except ValueError:
+                return match.group(0)
+        return DATA_URI_PATTERN.sub(replace, text)
+
+    @staticmethod
+    def _clean_ext(ext: Optional[str]) -> str:
+        ext = (ext or "").lower().lstrip(".")
+        return ext if ext.isalnum() and len(ext) <= 5 else "bin"
+
+blob_store = BlobStore(settings.UPLOAD_DIR)
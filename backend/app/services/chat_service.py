@@ -1,104 +1,173 @@
 from openai import AsyncOpenAI
+from app.core.cache import LRUCache
 from app.core.config import settings
-import json
+from app.core.media import sniff_mime
+from app.core.metrics import registry, stage
+from app.services.blob_store import blob_store
+from app.services.image_derivatives import derivative_store, UnsupportedImageError, DERIVATIVE_MEDIA_TYPE
+from app.services.provider_router import ProviderRouter
+from app.services.response_cache import response_cache
+from typing import Optional
+from urllib.parse import urlsplit
+import asyncio
+import logging
+import mimetypes
 import os
 import base64
 
+logger = logging.getLogger(__name__)
+
+def _encode_image_file(filepath: str) -> str:
+    with open(filepath, "rb") as image_file:
+        data = image_file.read()
+    # Trust the bytes; fall back to the extension for formats we cannot sniff
+    mime_type = sniff_mime(data)
+    if not mime_type or not mime_type.startswith("image/"):
+        mime_type = mimetypes.guess_type(filepath)[0] or "image/jpeg"
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+def _prepare_image_file(filepath: str, max_side: int) -> str:
+    """Data URI of an uploaded image downscaled to max_side; the original if it cannot be resized."""
+    try:
+        digest = blob_store.digest_of(os.path.basename(filepath))
+        path = derivative_store.get(filepath, digest, max_side, settings.VISION_IMAGE_QUALITY)
+    except UnsupportedImageError:
+        return _encode_image_file(filepath)
+    # The resized copy is kept on disk, so later turns and restarts skip the resize
+    with open(path, "rb") as image_file:
+        data = image_file.read()
+    return f"data:{DERIVATIVE_MEDIA_TYPE};base64,{base64.b64encode(data).decode('utf-8')}"
+
 class ChatService:
     def __init__(self):
         self.clients = {}
+        # (path, mtime, size, max side) -> data URI of local uploads sent to vision models
+        self.image_cache = LRUCache(settings.IMAGE_CACHE_BYTES)
         
         if settings.QWEN_API_KEY:
             self.clients['qwen'] = AsyncOpenAI(
                 api_key=settings.QWEN_API_KEY,
-                base_url=settings.QWEN_BASE_URL
+                base_url=settings.QWEN_BASE_URL,
+                max_retries=0 # The router retries, on another provider if need be
             )
         
         if settings.DEEPSEEK_API_KEY:
             self.clients['deepseek'] = AsyncOpenAI(
                 api_key=settings.DEEPSEEK_API_KEY,
-                base_url=settings.DEEPSEEK_BASE_URL
+                base_url=settings.DEEPSEEK_BASE_URL,
+                max_retries=0
             )
 
+        self.router = ProviderRouter(self.clients)
+
     def get_client(self, model_name: str):
-        if 'qwen' in model_name.lower():
-            return self.clients.get('qwen')
-        elif 'deepseek' in model_name.lower():
-            return self.clients.get('deepseek')
-        # Default to qwen if available, else deepseek
-        if self.clients.get('qwen'):
-            return self.clients['qwen']
-        return self.clients.get('deepseek')
-
-    def _process_messages_for_api(self, messages):
+        provider = self.router.provider_for(model_name)
+        return provider.client if provider else None
+
+    def _local_upload_path(self, url: str):
+        """Path of an uploaded file if the URL points at this server's /uploads, else None."""
+        is_local = url.startswith(f"{settings.PUBLIC_BASE_URL}/uploads/") or ("localhost" in url and "/uploads/" in url)
+        if not is_local:
+            return None
+        filename = os.path.basename(urlsplit(url).path)
+        return os.path.join(settings.UPLOAD_DIR, filename)
+
+    async def _encode_local_image(self, filepath: str, model: str) -> str:
+        """Data URI for an uploaded image prepared for model, cached by path and modification time."""
+        max_side = settings.VISION_IMAGE_MAX_SIDE.get(model, settings.VISION_IMAGE_DEFAULT_MAX_SIDE)
+        stat = await asyncio.to_thread(os.stat, filepath)
+        key = (filepath, stat.st_mtime_ns, stat.st_size, max_side)
+        data_uri = self.image_cache.get(key)
+        if data_uri is None:
+            data_uri = await asyncio.to_thread(_prepare_image_file, filepath, max_side)
+            self.image_cache.set(key, data_uri)
+        return data_uri
+
+    async def _process_messages_for_api(self, messages, model):
         """
         Intercepts messages containing local localhost URLs and converts them to Base64 
-        so the LLM can read them.
+        so the LLM can read them, downscaled for the model (VISION_IMAGE_MAX_SIDE).
+        File reads and encoding run off the event loop.
         """
         processed_messages = []
         for msg in messages:
             if isinstance(msg.get('content'), list):
                 new_content = []
                 for item in msg['content']:
+                    filepath = None
                     if item.get('type') == 'image_url':
-                        url = item['image_url']['url']
-                        # Check if it is a local URL
-                        if "localhost" in url and "/uploads/" in url:
-                            try:
-                                # Extract filename
-                                filename = url.split("/uploads/")[-1]
-                                # Assuming uploads directory is in the current working directory
-                                filepath = os.path.join("uploads", filename)
-                                
-                                if os.path.exists(filepath):
-                                    with open(filepath, "rb") as image_file:
-                                        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                                        # Guess mime type
-                                        ext = filename.split('.')[-1].lower()
-                                        mime_type = "image/jpeg"
-                                        if ext == 'png': mime_type = "image/png"
-                                        elif ext == 'webp': mime_type = "image/webp"
-                                        elif ext == 'gif': mime_type = "image/gif"
-                                        
-                                        new_content.append({
-                                            "type": "image_url",
-                                            "image_url": {"url": f"data:{mime_type};base64,{encoded_string}"}
-                                        })
-                                else:
-                                    # File not found, keep URL (will likely fail but what else to do?)
-                                    new_content.append(item)
-                            except Exception as e:
-                                print(f"Error processing local image: {e}")
-                                new_content.append(item)
-                        else:
-                            new_content.append(item)
-                    else:
+                        filepath = self._local_upload_path(item['image_url']['url'])
+                    if filepath is None:
+                        new_content.append(item)
+                        continue
+                    try:
+                        new_content.append({
+                            "type": "image_url",
+                            "image_url": {"url": await self._encode_local_image(filepath, model)}
+                        })
+                    except FileNotFoundError:
+                        # File not found, keep URL (will likely fail but what else to do?)
+                        new_content.append(item)
+                    except Exception as e:
+                        logger.warning("Error processing local image %s: %s", filepath, e)
                         new_content.append(item)
                 processed_messages.append({**msg, "content": new_content})
             else:
                 processed_messages.append(msg)
         return processed_messages
 
-    async def chat_completion_stream(self, messages, model="qwen-plus"):
-        client = self.get_client(model)
-        if not client:
-            yield "Error: Model client not configured."
-            return
+    async def chat_completion_stream(self, messages, model="qwen-plus", cache: Optional[str] = None):
+        """
+        Yield the reply as it is generated; raises ProviderError when no
+        provider can answer or the reply breaks off. cache names the calling
+        endpoint; where LLM_CACHE_ENDPOINTS enables it, an identical earlier
+        request is replayed from the response cache.
+        """
+        key = response_cache.key_for(model, messages, stream=True) if response_cache.enabled(cache) else None
+        if key:
+            cached = response_cache.get(key, cache)
+            if cached is not None:
+                async for chunk in response_cache.replay(cached):
+                    yield chunk
+                return
 
         # Process messages to handle local images
-        api_messages = self._process_messages_for_api(messages)
+        with stage("image_encoding"):
+            api_messages = await self._process_messages_for_api(messages, model)
 
-        try:
-            stream = await client.chat.completions.create(
-                model=model,
-                messages=api_messages,
-                stream=True
-            )
-            
-            async for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
-        except Exception as e:
-            yield f"Error: {str(e)}"
+        parts = []
+        async for chunk in self.router.stream(api_messages, model):
+            parts.append(chunk)
+            yield chunk
+        # Only reached when the reply completed and was read to the end
+        if key:
+            response_cache.set(key, cache, messages, "".join(parts))
+
+    async def chat_completion(self, messages, model="qwen-plus", max_tokens=None, cache: Optional[str] = None) -> str:
+        """
+        The whole reply in one response, for short internal prompts such as
+        titles and summaries. Raises ProviderError when no provider answers.
+        """
+        key = response_cache.key_for(model, messages, max_tokens=max_tokens) if response_cache.enabled(cache) else None
+        if key:
+            cached = response_cache.get(key, cache)
+            if cached is not None:
+                return cached
+
+        api_messages = await self._process_messages_for_api(messages, model)
+        params = {"max_tokens": max_tokens} if max_tokens else {}
+        text = (await self.router.complete(api_messages, model, **params)).strip()
+        if key:
+            response_cache.set(key, cache, messages, text)
+        return text
 
 chat_service = ChatService()
+
+registry.gauge(
+    "llm_in_flight", "Model requests running per provider", ["provider"],
+    collect=lambda: {name: provider.in_flight for name, provider in chat_service.router.providers.items()},
+)
+registry.gauge(
+    "llm_circuit_open", "1 while a provider's circuit breaker is open", ["provider"],
+    collect=lambda: {name: int(provider.state == "open") for name, provider in chat_service.router.providers.items()},
+)
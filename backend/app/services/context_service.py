@@ -0,0 +1,109 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.tokens import estimate_tokens
+from app.db import models, database
+from app.services.chat_service import chat_service
+
+SUMMARY_INPUT_CHARS = 2000 # Per message folded into the summary
+
+class ContextService:
+    def __init__(self):
+        # Sessions whose summary is being refreshed right now
+        self._refreshing = set()
+
+    def budget_for(self, model: str) -> int:
+        return settings.MODEL_CONTEXT_BUDGETS.get(model, settings.CONTEXT_TOKEN_BUDGET)
+
+    def _unsummarized(self, session: models.ChatSession):
+        """Select statement for the messages after the summary."""
+        query = select(models.ChatMessage).where(models.ChatMessage.session_id == session.id)
+        if session.summary_message_id:
+            query = query.where(models.ChatMessage.id > session.summary_message_id)
+        return query
+
+    async def build_messages(self, db: AsyncSession, session: models.ChatSession, model: str) -> list[dict]:
+        """
+        Messages to send for the next turn: the rolling summary followed by as
+        many of the most recent messages as fit in the model's token budget.
+        The newest message is always included.
+        """
+        budget = self.budget_for(model)
+        used = estimate_tokens(session.summary) if session.summary else 0
+
+        recent = []
+        newest_first = await db.scalars(self._unsummarized(session).order_by(
+            models.ChatMessage.created_at.desc(), models.ChatMessage.id.desc()
+        ).limit(settings.CONTEXT_MAX_MESSAGES))
+        for msg in newest_first:
+            cost = estimate_tokens(msg.content)
+            if recent and used + cost > budget:
+                break
+            recent.append({"role": msg.role, "content": msg.content})
+            used += cost
+        recent.reverse()
+
+        if session.summary:
+            recent.insert(0, {"role": "system", "content": f"Summary of the earlier conversation:\n{session.summary}"})
+        return recent
+
+    async def refresh_summary(self, session_id: int, model: str):
+        """
+        Fold messages that have fallen out of the recent half of the budget
+        into the session summary. Runs as a background job after a reply;
+        failures are raised so the job is retried.
+        """
+        if session_id in self._refreshing:
+            return
+        self._refreshing.add(session_id)
+        db = database.AsyncSessionLocal()
+        try:
+            session = await db.get(models.ChatSession, session_id)
+            if not session:
+                return
+
+            messages = (await db.scalars(
+                self._unsummarized(session).order_by(models.ChatMessage.created_at, models.ChatMessage.id)
+            )).all()
+
+            # Keep the newest messages verbatim up to half the budget, summarize the rest.
+            # Long backlogs are folded a batch at a time over several turns.
+            keep_tokens = self.budget_for(model) // 2
+            used = 0
+            split = len(messages)
+            while split > 0:
+                used += estimate_tokens(messages[split - 1].content)
+                if used > keep_tokens:
+                    break
+                split -= 1
+            older = messages[:split][:settings.CONTEXT_MAX_MESSAGES]
+            if not older:
+                return
+
+            conversation = "\n".join(f"{msg.role}: {msg.content[:SUMMARY_INPUT_CHARS]}" for msg in older)
+            prompt = (
+                "You maintain a running summary of a conversation. Update the summary with the new messages. "
+                "Keep facts, decisions, names and open questions; drop small talk. "
+                "Answer with the updated summary only, in the conversation's language, under 300 words.\n\n"
+                f"Current summary:\n{session.summary or '(none)'}\n\nNew messages:\n{conversation}"
+            )
+            summary = await chat_service.chat_completion(
+                [{"role": "user", "content": prompt}],
+                model=settings.CONTEXT_SUMMARY_MODEL,
+                max_tokens=settings.SUMMARY_MAX_TOKENS,
+                cache="summary",
+            )
+            if not summary:
+                raise ValueError("Empty summary")
+
+            await db.refresh(session)
+            if session.summary_message_id and session.summary_message_id >= older[-1].id:
+                return
+            session.summary = summary
+            session.summary_message_id = older[-1].id
+            await db.commit()
+        finally:
+            await db.close()
+            self._refreshing.discard(session_id)
+
+context_service = ContextService()
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.db import models
+from app.core.tokens import estimate_tokens
+
+_WORD = re.compile(r'[a-z0-9\u00c0-\u024f]+')
+_CJK_RUN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+')
+_SENTENCE_END = re.compile(r'(?<=[.!?。！？;；])')
+STOPWORDS = frozenset(
+    "a an and are as at be by do does for from has have how i in is it its me my of on or "
+    "that the this to was were what when where which who why will with you your".split()
+)
+LEGACY_FILENAME = "Attached document"
+
+def tokenize(text: str) -> list[str]:
+    """Index terms: lowercased words, plus overlapping character pairs for CJK text, which has no spaces."""
+    text = text.lower()
+    terms = [word for word in _WORD.findall(text) if word not in STOPWORDS]
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+def _split_long(paragraph: str, max_tokens: int) -> list[str]:
+    """Break a paragraph that is over the chunk size at sentence ends, or anywhere as a last resort."""
+    pieces = []
+    current = ""
+    for sentence in _SENTENCE_END.split(paragraph):
+        if current and estimate_tokens(current + sentence) > max_tokens:
+            pieces.append(current)
+            current = ""
+        current += sentence
+        while estimate_tokens(current) > max_tokens:
+            # No sentence break: cut by characters (CJK text is about one token per character)
+            cut = max_tokens if _CJK_RUN.search(current) else max_tokens * 4
+            pieces.append(current[:cut])
+            current = current[cut:]
+    if current:
+        pieces.append(current)
+    return pieces
+
+def chunk_text(text: str, max_tokens: int) -> list[str]:
+    """Split text into chunks of about max_tokens, keeping paragraphs together where they fit."""
+    chunks = []
+    current = []
+    used = 0
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        for piece in _split_long(paragraph, max_tokens):
+            cost = estimate_tokens(piece)
+            if current and used + cost > max_tokens:
+                chunks.append("\n\n".join(current))
+                current = []
+                used = 0
+            current.append(piece)
+            used += cost
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def reference_for(filename: str) -> str:
+    """What a stored message keeps in place of the document's text."""
+    return f"[Document: {filename}]"
+
+class BM25Index:
+    """In-memory inverted index over a session's chunks, scored with Okapi BM25."""
+
+    def __init__(self, chunks: list[dict], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks # In document and reading order
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list) # term -> [(chunk index, term frequency)]
+        self.lengths = []
+        postings = 0
+        for i, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk["content"]))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((i, tf))
+            postings += len(counts)
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 1.0
+        # Rough footprint, for the index cache's byte budget
+        self.size = sum(len(chunk["content"]) for chunk in chunks) * 2 + postings * 80
+
+    @property
+    def token_count(self) -> int:
+        return sum(chunk["token_count"] for chunk in self.chunks)
+
+    def search(self, query: str, k: int) -> list[int]:
+        """Indexes of the k best-scoring chunks, best first. Empty if no query term occurs."""
+        n = len(self.chunks)
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                length_norm = 1 - self.b + self.b * self.lengths[i] / self.avg_length
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+        return [i for i, _ in heapq.nlargest(k, scores.items(), key=lambda item: item[1])]
+
+    def _openings(self) -> list[int]:
+        """Chunk indexes taking each document's start in turn, newest document first."""
+        return sorted(range(len(self.chunks)), key=lambda i: (self.chunks[i]["ordinal"], -self.chunks[i]["document_id"]))
+
+    def select(self, query: str, k: int, budget: int) -> list[dict]:
+        """
+        Chunks to send for a query, in reading order. Everything when it fits in
+        the budget; otherwise the top k matches that fit, or the start of each
+        document when nothing matches (e.g. "summarize this").
+        """
+        if self.token_count <= budget:
+            return list(self.chunks)
+        ranked = self.search(query, k) or self._openings()
+        selected = []
+        used = 0
+        for i in ranked:
+            cost = self.chunks[i]["token_count"]
+            if used + cost > budget:
+                continue
+            selected.append(i)
+            used += cost
+            if len(selected) >= k:
+                break
+        return [self.chunks[i] for i in sorted(selected)]
+
+class DocumentService:
+    """
+    Uploaded documents are stored as chunks and attached to a session. Each
+    turn sends only the chunks most relevant to the question instead of the
+    whole text, and messages keep a short reference to the document.
+    """
+
+    def __init__(self):
+        # session_id -> (document ids, BM25Index); rebuilt when the session's documents change
+        self.indexes = LRUCache(settings.DOCUMENT_INDEX_CACHE_BYTES, sizeof=lambda entry: entry[1].size)
+
+    async def add_document(self, db: AsyncSession, user_id: int, filename: str, text: str) -> models.Document:
+        """Chunk and store extracted text. Uploading the same text again reuses the unattached document."""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        existing = await db.scalar(select(models.Document).where(
+            models.Document.user_id == user_id,
+            models.Document.content_hash == digest,
+            models.Document.session_id.is_(None),
+        ).limit(1))
+        if existing:
+            return existing
+
+        chunks = await asyncio.to_thread(chunk_text, text, settings.DOCUMENT_CHUNK_TOKENS)
+        document = models.Document(user_id=user_id, filename=filename, content_hash=digest)
+        document.chunks = [
+            models.DocumentChunk(ordinal=i, content=chunk, token_count=estimate_tokens(chunk))
+            for i, chunk in enumerate(chunks)
+        ]
+        document.token_count = sum(chunk.token_count for chunk in document.chunks)
+        db.add(document)
+        await db.commit()
+        return document
+
+    async def attach(self, db: AsyncSession, session: models.ChatSession, document_ids: list[int]) -> list[models.Document]:
+        """
+        Attach the session owner's documents to the session. A document already
+        used in another session is copied, so each session has its own set.
+        """
+        if not document_ids:
+            return []
+        documents = (await db.scalars(select(models.Document).options(selectinload(models.Document.chunks)).where(
+            models.Document.id.in_(document_ids),
+            models.Document.user_id == session.user_id,
+        ).order_by(models.Document.id))).all()
+        attached = []
+        for document in documents:
+            if document.session_id is None:
+                document.session_id = session.id
+            elif document.session_id != session.id:
+                document = models.Document(
+                    user_id=document.user_id,
+                    session_id=session.id,
+                    filename=document.filename,
+                    content_hash=document.content_hash,
+                    token_count=document.token_count,
+                    chunks=[
+                        models.DocumentChunk(ordinal=chunk.ordinal, content=chunk.content, token_count=chunk.token_count)
+                        for chunk in document.chunks
+                    ],
+                )
+                db.add(document)
+            attached.append(document)
+        await db.commit()
+        return attached
+
+    async def _index_for(self, db: AsyncSession, session_id: int):
+        document_ids = tuple(await db.scalars(
+            select(models.Document.id).where(models.Document.session_id == session_id).order_by(models.Document.id)
+        ))
+        if not document_ids:
+            return None
+        cached = self.indexes.get(session_id)
+        if cached is not None and cached[0] == document_ids:
+            return cached[1]
+
+        rows = (await db.execute(select(models.DocumentChunk, models.Document.filename).join(models.Document).where(
+            models.Document.session_id == session_id
+        ).order_by(models.DocumentChunk.document_id, models.DocumentChunk.ordinal))).all()
+        chunks = [
+            {
+                "document_id": chunk.document_id,
+                "filename": filename,
+                "ordinal": chunk.ordinal,
+                "content": chunk.content,
+                "token_count": chunk.token_count,
+            }
+            for chunk, filename in rows
+        ]
+        index = await asyncio.to_thread(BM25Index, chunks)
+        self.indexes.set(session_id, (document_ids, index))
+        return index
+
+    async def excerpts(self, db: AsyncSession, session_id: int, query: str) -> str:
+        """The session's document chunks relevant to query, formatted for the prompt; empty if none."""
+        index = await self._index_for(db, session_id)
+        if index is None:
+            return ""
+        selected = index.select(query, settings.DOCUMENT_TOP_K, settings.DOCUMENT_CONTEXT_TOKENS)
+        return "\n\n".join(f"[{chunk['filename']}, part {chunk['ordinal'] + 1}]\n{chunk['content']}" for chunk in selected)
+
+document_service = DocumentService()
@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Optional
+from app.core.config import settings
+
+class ExtractionCache:
+    """
+    Extraction results on disk, keyed by the hash of the uploaded bytes, the
+    file type and the extractor version. The least recently used entries are
+    evicted once the directory grows past max_bytes. Blocking and
+    thread-safe: call it through asyncio.to_thread from async code.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None # key -> [size, last_used]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(digest: str, filename: str, version: int) -> str:
+        ext = os.path.splitext(filename)[1].lower().lstrip(".") or "none"
+        return f"{digest}-{ext}-v{version}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_index(self):
+        # Built lazily from the directory so the cache survives restarts
+        if self._index is not None:
+            return
+        self._index = {}
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                self._index[name[:-5]] = [stat.st_size, stat.st_mtime]
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self._remove(key)
+                self.misses += 1
+                return None
+            now = time.time()
+            self._index[key][1] = now
+            # The mtime carries the LRU order across restarts
+            os.utime(self._path(key), (now, now))
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: dict):
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._load_index()
+            path = self._path(key)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._index[key] = [len(data), time.time()]
+            self._evict()
+
+    def _evict(self):
+        total = sum(size for size, _ in self._index.values())
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            self.evictions += 1
+            total -= size
+
+    def _remove(self, key: str) -> bool:
+        self._index.pop(key, None)
+        try:
+            os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            self._load_index()
+            # Only known keys: the key comes from a URL and must not become an arbitrary path
+            if key not in self._index:
+                return False
+            return self._remove(key)
+
+    def purge(self) -> int:
+        with self._lock:
+            self._load_index()
+            keys = list(self._index)
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def entries(self, limit: int = 100) -> list[dict]:
+        """Most recently used entries first."""
+        with self._lock:
+            self._load_index()
+            items = sorted(self._index.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [{"key": key, "bytes": size, "last_used": last_used} for key, (size, last_used) in items]
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load_index()
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": sum(size for size, _ in self._index.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+extraction_cache = ExtractionCache(settings.EXTRACTION_CACHE_DIR, settings.EXTRACTION_CACHE_MAX_BYTES)
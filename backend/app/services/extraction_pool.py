@@ -0,0 +1,208 @@
+import asyncio
+import multiprocessing
+import signal
+import statistics
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from app.core.config import settings
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+class ExtractionBusyError(Exception):
+    """Every worker is busy and the queue is full."""
+
+class ExtractionTimeoutError(Exception):
+    """A job ran past its wall-clock limit."""
+
+class _JobTimeout(Exception):
+    pass
+
+class _PoolRestarted(Exception):
+    # Internal: the pool was restarted because of another job; this one can run again
+    pass
+
+def _init_worker(memory_limit_bytes: int):
+    if resource is not None and memory_limit_bytes > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+
+def _on_alarm(signum, frame):
+    raise _JobTimeout()
+
+def _run_job(fn, args, timeout: float):
+    """Runs inside a worker process. Uses SIGALRM where available so a slow job
+    is stopped without killing the worker."""
+    use_alarm = hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args)
+    except _JobTimeout:
+        raise ExtractionTimeoutError(f"Job exceeded {timeout:g}s")
+    except MemoryError:
+        raise MemoryError("Job exceeded the worker memory limit")
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+class ExtractionPool:
+    """
+    Bounded process pool for CPU-heavy document parsing. Admission is per
+    document: callers reserve a slot with acquire()/admit() and may then run
+    several jobs (e.g. page batches). Documents beyond workers + queue_depth
+    are rejected immediately with ExtractionBusyError.
+    """
+
+    def __init__(self, workers: int, queue_depth: int, timeout: float, memory_limit_mb: int):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.memory_limit_bytes = memory_limit_mb * 1024 * 1024
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.documents = 0 # Admitted and not yet released
+        self.in_flight = 0 # Jobs submitted to the executor
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+        self.resubmitted = 0
+        self._generation = 0 # Bumped on every restart
+        self.durations = deque(maxlen=200) # Seconds, most recent jobs
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # spawn: forking a process that runs an event loop and threads is unsafe
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.memory_limit_bytes,),
+            )
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _restart(self):
+        """
+        Kill the workers (e.g. one stuck past its timeout) and start afresh.
+        Jobs of other documents that were running or queued are submitted
+        again by run().
+        """
+        executor = self._executor
+        self._executor = None
+        self._generation += 1
+        if executor is not None:
+            for process in list(getattr(executor, "_processes", {}).values()):
+                process.terminate()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def is_full(self) -> bool:
+        return self.documents >= self.workers + self.queue_depth
+
+    def acquire(self):
+        """Reserve a slot for one document; pair with release()."""
+        if self.is_full():
+            self.rejected += 1
+            raise ExtractionBusyError("Document processing is busy, please retry shortly")
+        self.documents += 1
+
+    def release(self):
+        self.documents -= 1
+
+    @asynccontextmanager
+    async def admit(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def run(self, fn, *args):
+        """
+        Run fn(*args) in a worker process and return its result. A job lost
+        to a restart caused by another job is submitted once more.
+        """
+        for attempt in range(2):
+            try:
+                return await self._run_once(fn, args)
+            except _PoolRestarted:
+                if attempt > 0:
+                    raise BrokenProcessPool("The worker pool was restarted twice while the job waited")
+                self.resubmitted += 1
+
+    async def _run_once(self, fn, args):
+        self.in_flight += 1
+        started = time.monotonic()
+        future = None
+        generation = self._generation
+        try:
+            future = self.start().submit(_run_job, fn, args, self.timeout)
+            # The in-worker alarm normally fires first; this is the backstop for
+            # jobs stuck in C code or platforms without SIGALRM. Time spent queued
+            # counts against it, so allow for a full queue ahead of this job.
+            backstop = self.timeout * (1 + self.in_flight / self.workers) + 5
+            result = await asyncio.wait_for(asyncio.wrap_future(future), backstop)
+            self.completed += 1
+            return result
+        except (asyncio.TimeoutError, ExtractionTimeoutError):
+            self.timed_out += 1
+            if future is not None and not future.done():
+                self._restart()
+            raise ExtractionTimeoutError("Document processing timed out")
+        except asyncio.CancelledError:
+            # Queued jobs are cancelled when the pool is shut down for a restart;
+            # a cancellation of the caller itself is passed on
+            task = asyncio.current_task()
+            caller_cancelled = getattr(task, "cancelling", lambda: 0)() > 0
+            if future is not None and future.cancelled() and self._generation != generation and not caller_cancelled:
+                raise _PoolRestarted()
+            raise
+        except BrokenProcessPool:
+            if self._generation != generation:
+                # Killed by a restart for another job
+                raise _PoolRestarted()
+            # A worker died (e.g. killed for memory); the pool cannot be reused
+            self.failed += 1
+            self._restart()
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.durations.append(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        durations = sorted(self.durations)
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "documents": self.documents,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.workers),
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "rejected": self.rejected,
+            "resubmitted": self.resubmitted,
+            "duration_p50": statistics.median(durations) if durations else None,
+            "duration_p95": durations[int(len(durations) * 0.95)] if durations else None,
+            "duration_max": durations[-1] if durations else None,
+        }
+
+extraction_pool = ExtractionPool(
+    workers=settings.EXTRACTION_WORKERS,
+    queue_depth=settings.EXTRACTION_QUEUE_DEPTH,
+    timeout=settings.EXTRACTION_TIMEOUT,
+    memory_limit_mb=settings.EXTRACTION_MEMORY_LIMIT_MB,
+)
@@ -1,76 +1,204 @@
-import io
-import base64
+import asyncio
+import hashlib
+import mimetypes
 import os
 import uuid
+import aiofiles
+from typing import Optional
+from fastapi import UploadFile
 from pypdf import PdfReader
 from docx import Document
+from app.core.config import settings
+from app.services.blob_store import blob_store
+from app.services.extraction_cache import extraction_cache
+from app.services.extraction_pool import extraction_pool, ExtractionBusyError
 
-UPLOAD_DIR = "uploads"
+# Bump whenever extraction output changes, so cached results are not reused
+EXTRACTOR_VERSION = 1
+SPOOL_CHUNK = 1024 * 1024
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+class UploadTooLargeError(ValueError):
+    pass
+
+class UnsupportedFileError(ValueError):
+    pass
 
 def save_image(image_data: bytes, ext: str) -> str:
-    """Save image bytes to disk and return the URL."""
-    filename = f"{uuid.uuid4()}.{ext}"
-    filepath = os.path.join(UPLOAD_DIR, filename)
-    
-    with open(filepath, "wb") as f:
-        f.write(image_data)
-        
-    # Assuming backend is on localhost:8000. In prod, use env var.
-    return f"http://localhost:8000/uploads/{filename}"
-
-async def process_file(file_content: bytes, filename: str) -> dict:
-    filename_lower = filename.lower()
-    result = {"text": "", "images": []}
-    
+    """Save image bytes to the blob store and return the URL. Identical images share one file."""
+    return blob_store.url_for(blob_store.put(image_data, ext))
+
+async def spool_upload(file: UploadFile) -> tuple[str, str]:
+    """
+    Copy an upload to a temporary file in chunks. Returns its path and the
+    SHA-256 of its bytes; the caller removes the file.
+    """
+    os.makedirs(settings.SPOOL_DIR, exist_ok=True)
+    path = os.path.join(settings.SPOOL_DIR, uuid.uuid4().hex)
+    sha = hashlib.sha256()
+    size = 0
     try:
-        if filename_lower.endswith('.pdf'):
-            reader = PdfReader(io.BytesIO(file_content))
-            for page in reader.pages:
-                # Extract text
-                extracted = page.extract_text()
-                if extracted:
-                    result["text"] += extracted + "\n"
-                
-                # Extract images
-                if page.images:
-                    for image in page.images:
-                        ext = image.name.split('.')[-1].lower()
-                        # Normalize extension
-                        if ext not in ['png', 'jpg', 'jpeg', 'webp', 'gif']:
-                            ext = 'jpg'
-                            
-                        image_url = save_image(image.data, ext)
-                        
-                        result["images"].append({
-                            "content": image_url,
-                            "mime_type": f"image/{ext}",
-                            "name": image.name
-                        })
-
-        elif filename_lower.endswith('.docx'):
-            doc = Document(io.BytesIO(file_content))
-            for para in doc.paragraphs:
-                result["text"] += para.text + "\n"
-
-        elif filename_lower.endswith('.txt'):
-            result["text"] = file_content.decode('utf-8')
-
-        elif filename_lower.endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')):
-            ext = filename_lower.split('.')[-1]
-            image_url = save_image(file_content, ext)
-            mime_type = f"image/{ext}"
-            if ext == 'jpg': mime_type = "image/jpeg"
-            
-            result["images"].append({
-                "content": image_url,
-                "mime_type": mime_type,
-                "name": filename
+        async with aiofiles.open(path, "wb") as out:
+            while chunk := await file.read(SPOOL_CHUNK):
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_BYTES:
+                    raise UploadTooLargeError(f"File is larger than {settings.UPLOAD_MAX_BYTES // (1024 * 1024)} MB")
+                sha.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        remove_spooled(path)
+        raise
+    return path, sha.hexdigest()
+
+def remove_spooled(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# The functions below run in the extraction process pool
+
+def count_pdf_pages(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+def extract_pdf_pages(path: str, start: int, end: int) -> list[dict]:
+    """Text and images of pages [start, end). Images are stored as soon as they are found."""
+    reader = PdfReader(path)
+    pages = []
+    for index in range(start, min(end, len(reader.pages))):
+        page = reader.pages[index]
+        images = []
+        for image in page.images:
+            ext = image.name.split('.')[-1].lower()
+            # Normalize extension
+            if ext not in ['png', 'jpg', 'jpeg', 'webp', 'gif']:
+                ext = 'jpg'
+
+            images.append({
+                "content": save_image(image.data, ext),
+                "mime_type": f"image/{ext}",
+                "name": image.name
             })
-        
-        else:
-            return {"error": "Unsupported file format."}
+        extracted = page.extract_text()
+        pages.append({"page": index + 1, "text": extracted + "\n" if extracted else "", "images": images})
+    return pages
+
+def extract_docx(path: str) -> str:
+    doc = Document(path)
+    return "".join(para.text + "\n" for para in doc.paragraphs)
+
+async def get_cached(filename: str, digest: str) -> Optional[dict]:
+    """Earlier extraction result for the same bytes and file type, if any."""
+    key = extraction_cache.make_key(digest, filename, EXTRACTOR_VERSION)
+    return await asyncio.to_thread(extraction_cache.get, key)
+
+async def replay_cached(cached: dict):
+    """Yield a cached result as the same events a fresh extraction produces."""
+    yield {"type": "start", "pages": cached["total"], "cached": True}
+    for page in cached["pages"]:
+        yield {"type": "page", **page}
+    yield {"type": "progress", "done": cached["total"], "total": cached["total"]}
+    yield {"type": "done", "cached": True}
 
-        return result
+async def iter_file_events(path: str, filename: str, digest: Optional[str] = None):
+    """
+    Extract a spooled upload, yielding events as results become available:
+    "start" (page count), one "page" per page with its text and images,
+    "progress" after each batch of pages and a final "done". With the
+    upload's digest, the result is saved to the extraction cache.
+    """
+    key = extraction_cache.make_key(digest, filename, EXTRACTOR_VERSION) if digest else None
+    total = 0
+    pages = []
+    async for event in _extract_events(path, filename):
+        if event["type"] == "start":
+            total = event["pages"]
+        elif event["type"] == "page":
+            pages.append({k: v for k, v in event.items() if k != "type"})
+        elif event["type"] == "done" and key:
+            pages.sort(key=lambda page: page["page"])
+            await asyncio.to_thread(extraction_cache.put, key, {"filename": filename, "total": total, "pages": pages})
+        yield event
 
+async def _extract_events(path: str, filename: str):
+    """Run the extraction itself; PDF page batches run in parallel across the pool's workers."""
+    filename_lower = filename.lower()
+
+    if filename_lower.endswith('.pdf'):
+        total = await extraction_pool.run(count_pdf_pages, path)
+        yield {"type": "start", "pages": total}
+
+        # At most one batch per worker per document, so several uploads share the pool
+        limit = asyncio.Semaphore(extraction_pool.workers)
+        async def run_batch(start):
+            async with limit:
+                return await extraction_pool.run(extract_pdf_pages, path, start, start + settings.PDF_PAGES_PER_JOB)
+
+        tasks = [asyncio.create_task(run_batch(start)) for start in range(0, total, settings.PDF_PAGES_PER_JOB)]
+        done = 0
+        try:
+            for next_batch in asyncio.as_completed(tasks):
+                pages = await next_batch
+                for page in pages:
+                    yield {"type": "page", **page}
+                done += len(pages)
+                yield {"type": "progress", "done": done, "total": total}
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    elif filename_lower.endswith('.docx'):
+        yield {"type": "start", "pages": 1}
+        text = await extraction_pool.run(extract_docx, path)
+        yield {"type": "page", "page": 1, "text": text, "images": []}
+
+    elif filename_lower.endswith('.txt'):
+        yield {"type": "start", "pages": 1}
+        async with aiofiles.open(path, "r", encoding="utf-8") as f:
+            text = await f.read()
+        yield {"type": "page", "page": 1, "text": text, "images": []}
+
+    elif filename_lower.endswith(IMAGE_EXTENSIONS):
+        yield {"type": "start", "pages": 1}
+        ext = filename_lower.split('.')[-1]
+        stored = await asyncio.to_thread(blob_store.put_file, path, ext)
+        image_url = blob_store.url_for(stored)
+        # The blob is named after the sniffed content, which may disagree with the upload's extension
+        mime_type = mimetypes.guess_type(stored)[0] or f"image/{ext}"
+        yield {"type": "page", "page": 1, "text": "", "images": [{
+            "content": image_url,
+            "mime_type": mime_type,
+            "name": filename
+        }]}
+
+    else:
+        raise UnsupportedFileError("Unsupported file format.")
+
+    yield {"type": "done"}
+
+async def process_file(path: str, filename: str, digest: Optional[str] = None) -> dict:
+    """Extract a spooled upload in one go: {"text", "images"} or {"error"}."""
+    pages = []
+    try:
+        cached = await get_cached(filename, digest) if digest else None
+        if cached is not None:
+            pages = list(cached["pages"])
+        else:
+            async with extraction_pool.admit():
+                async for event in iter_file_events(path, filename, digest):
+                    if event["type"] == "page":
+                        pages.append(event)
+    except ExtractionBusyError:
+        # Not a problem with the file; let the caller tell the client to retry
+        raise
+    except UnsupportedFileError as e:
+        return {"error": str(e)}
     except Exception as e:
         return {"error": f"Error processing file: {str(e)}"}
+
+    pages.sort(key=lambda page: page["page"])
+    return {
+        "text": "".join(page["text"] for page in pages),
+        "images": [image for page in pages for image in page["images"]],
+    }
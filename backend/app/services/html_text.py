@@ -0,0 +1,96 @@
+from html.parser import HTMLParser
+
+# Same elements the BeautifulSoup path used to decompose, plus a few that never hold page text
+SKIP_TAGS = {"script", "style", "nav", "footer", "header", "noscript", "template", "svg"}
+# Elements that start a new line in the rendered page
+BLOCK_TAGS = {
+    "p", "div", "br", "li", "ul", "ol", "tr", "td", "th", "table", "section", "article",
+    "main", "aside", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "title", "dd", "dt",
+}
+FEED_CHUNK = 64 * 1024
+
+class _BudgetReached(Exception):
+    pass
+
+class _TextExtractor(HTMLParser):
+    """
+    Streams visible text out of an HTML document without building a tree.
+    Lines are cleaned as they complete and parsing stops once max_chars of
+    cleaned text have been collected.
+    """
+
+    def __init__(self, max_chars: int):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.lines = []
+        self.length = 0
+        self.partial = ""
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            if self.skip_depth:
+                self.skip_depth -= 1
+        elif tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        self.partial += data
+        if "\n" in self.partial:
+            *complete, self.partial = self.partial.split("\n")
+            for line in complete:
+                self._add_line(line)
+        elif len(self.partial) > self.max_chars:
+            # One huge line (minified pages); flush it so the budget check can fire
+            self._newline()
+
+    def _newline(self):
+        if self.partial:
+            self._add_line(self.partial)
+            self.partial = ""
+
+    def _add_line(self, line):
+        # Same cleanup as before: strip lines, split multi-headlines, drop blanks
+        for phrase in line.strip().split("  "):
+            phrase = phrase.strip()
+            if phrase:
+                self.lines.append(phrase)
+                self.length += len(phrase) + 1
+        if self.length > self.max_chars:
+            raise _BudgetReached()
+
+    def finish(self) -> str:
+        try:
+            self._newline()
+        except _BudgetReached:
+            pass
+        return "\n".join(self.lines)
+
+def extract_text(html: str, max_chars: int = 10000) -> str:
+    """
+    Visible text of an HTML document, truncated to max_chars. CPU bound:
+    call it through asyncio.to_thread from async code.
+    """
+    parser = _TextExtractor(max_chars)
+    try:
+        for start in range(0, len(html), FEED_CHUNK):
+            parser.feed(html[start:start + FEED_CHUNK])
+        parser.close()
+    except _BudgetReached:
+        pass
+    text = parser.finish()
+    if len(text) > max_chars:
+        text = text[:max_chars] + "...(truncated)"
+    return text
@@ -0,0 +1,115 @@
+import os
+import threading
+import uuid
+from typing import Optional
+from PIL import Image, ImageOps
+from app.core.config import settings
+
+# Bump whenever derivative output changes, so cached files are not reused
+DERIVATIVE_VERSION = 1
+DERIVATIVE_MEDIA_TYPE = "image/webp"
+
+class UnsupportedImageError(ValueError):
+    pass
+
+def _resize(source: str, target: str, max_side: int, quality: int):
+    with Image.open(source) as image:
+        # JPEGs can be decoded straight at a fraction of their size
+        image.draft("RGB", (max_side, max_side))
+        # Animated images keep their first frame
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        # Written without EXIF or other metadata
+        tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            image.save(tmp_path, "WEBP", quality=quality, method=4)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+class DerivativeStore:
+    """
+    Downscaled WebP copies of uploaded images, made on first request and kept
+    on disk. A derivative is named after the SHA-256 of its original, its
+    size and quality, and DERIVATIVE_VERSION, so the name also serves as a
+    strong ETag. Concurrent requests for the same derivative resize it once.
+    Blocking and thread-safe: call it through asyncio.to_thread from async
+    code.
+    """
+
+    def __init__(self, directory: str, quality: int):
+        self.directory = directory
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.generated = 0
+        self.failures = 0
+
+    def name_for(self, digest: str, max_side: int, quality: Optional[int] = None) -> str:
+        return f"{digest}-{max_side}-q{quality or self.quality}-v{DERIVATIVE_VERSION}"
+
+    def get(self, source: str, digest: str, max_side: int, quality: Optional[int] = None) -> str:
+        """
+        Path of the derivative of the image at source, whose bytes hash to
+        digest; raises UnsupportedImageError if it is not an image.
+        """
+        name = self.name_for(digest, max_side, quality)
+        path = os.path.join(self.directory, f"{name}.webp")
+        if os.path.exists(path):
+            self.hits += 1
+            return path
+        with self._lock:
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+        try:
+            with key_lock:
+                # Made by another thread while this one waited
+                if os.path.exists(path):
+                    self.hits += 1
+                    return path
+                os.makedirs(self.directory, exist_ok=True)
+                try:
+                    _resize(source, path, max_side, quality or self.quality)
+                except (OSError, ValueError, Image.DecompressionBombError) as e:
+                    self.failures += 1
+                    raise UnsupportedImageError(f"Cannot resize {os.path.basename(source)}: {e}") from e
+                self.generated += 1
+                return path
+        finally:
+            with self._lock:
+                self._key_locks.pop(name, None)
+
+    def purge(self) -> int:
+        removed = 0
+        if not os.path.isdir(self.directory):
+            return removed
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def stats(self) -> dict:
+        entries = 0
+        total = 0
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".webp"):
+                    entries += 1
+                    total += entry.stat().st_size
+        return {
+            "entries": entries,
+            "bytes": total,
+            "hits": self.hits,
+            "generated": self.generated,
+            "failures": self.failures,
+        }
+
+derivative_store = DerivativeStore(settings.IMAGE_DERIVATIVE_DIR, settings.IMAGE_DERIVATIVE_QUALITY)
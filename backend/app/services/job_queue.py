@@ -0,0 +1,436 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional
+from app.core.config import settings
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+jobs_total = registry.counter("jobs_total", "Background job runs by kind and outcome (ok, retry, failed)", ["kind", "outcome"])
+job_seconds = registry.histogram("job_duration_seconds", "Time to run a background job", ["kind"])
+
+# Lower runs first
+PRIORITY_USER = 0 # Someone is waiting on the result
+PRIORITY_DEFAULT = 10
+PRIORITY_LOW = 20
+
+@dataclass
+class Job:
+    kind: str
+    payload: dict
+    priority: int = PRIORITY_DEFAULT
+    dedup_key: Optional[str] = None
+    run_at: float = field(default_factory=time.time)
+    attempts: int = 0
+    max_attempts: int = 1
+    id: Optional[int] = None
+    last_error: Optional[str] = None
+
+class Broker(ABC):
+    """
+    Storage for queued jobs. At most one queued job per dedup_key: enqueueing
+    another returns False. A job is claimed before it runs and then
+    completed, retried later or failed.
+    """
+
+    @abstractmethod
+    async def enqueue(self, job: Job) -> bool:
+        ...
+
+    @abstractmethod
+    async def claim(self, not_after: float) -> Optional[Job]:
+        """The next job due by not_after, by priority, marked running."""
+
+    @abstractmethod
+    async def complete(self, job: Job):
+        ...
+
+    @abstractmethod
+    async def retry(self, job: Job, run_at: float, error: str):
+        ...
+
+    @abstractmethod
+    async def fail(self, job: Job, error: str):
+        ...
+
+    @abstractmethod
+    async def counts(self) -> dict:
+        ...
+
+    async def close(self):
+        pass
+
+class InMemoryBroker(Broker):
+    """Jobs in a list; lost on restart. For tests and single-process development."""
+
+    def __init__(self):
+        self._queued: list[Job] = []
+        self._running: Dict[int, Job] = {}
+        self._next_id = 1
+        self.failed = 0
+
+    async def enqueue(self, job: Job) -> bool:
+        if job.dedup_key and any(queued.dedup_key == job.dedup_key for queued in self._queued):
+            return False
+        job.id = self._next_id
+        self._next_id += 1
+        self._queued.append(job)
+        return True
+
+    async def claim(self, not_after: float) -> Optional[Job]:
+        due = [job for job in self._queued if job.run_at <= not_after]
+        if not due:
+            return None
+        job = min(due, key=lambda job: (job.priority, job.run_at, job.id))
+        self._queued.remove(job)
+        job.attempts += 1
+        self._running[job.id] = job
+        return job
+
+    async def complete(self, job: Job):
+        self._running.pop(job.id, None)
+
+    async def retry(self, job: Job, run_at: float, error: str):
+        self._running.pop(job.id, None)
+        if job.dedup_key and any(queued.dedup_key == job.dedup_key for queued in self._queued):
+            return
+        job.run_at = run_at
+        job.last_error = error
+        self._queued.append(job)
+
+    async def fail(self, job: Job, error: str):
+        self._running.pop(job.id, None)
+        self.failed += 1
+
+    async def counts(self) -> dict:
+        return {"queued": len(self._queued), "running": len(self._running), "failed": self.failed}
+
+class SQLiteBroker(Broker):
+    """
+    Jobs in a SQLite file, so they survive restarts and can be shared by the
+    workers of one host. Running jobs whose lease ran out (the process died)
+    are queued again, or dropped if the same dedup_key is already queued;
+    failed jobs are kept for failed_retention seconds.
+    Calls run in a thread.
+    """
+
+    def __init__(self, path: str, lease_seconds: float, failed_retention: float):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.failed_retention = failed_retention
+        self._pruned_at = 0.0
+        self._conn: Optional[sqlite3.Connection] = None
+        # One connection shared by the worker threads; transactions must not interleave
+        self._lock = threading.Lock()
+
+    async def _call(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(*args)
+        return await asyncio.to_thread(locked)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    dedup_key TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    run_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    claimed_at REAL,
+                    last_error TEXT,
+                    failed_at REAL
+                )
+            """)
+            # Files created before failed jobs expired
+            if "failed_at" not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN failed_at REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_due ON jobs (status, priority, run_at)")
+            # At most one queued job per key; a running one may have another queued behind it
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_jobs_dedup ON jobs (dedup_key) WHERE status = 'queued'")
+            self._conn = conn
+        return self._conn
+
+    def _enqueue(self, job: Job) -> bool:
+        conn = self._connect()
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO jobs (kind, payload, priority, dedup_key, run_at, max_attempts) VALUES (?, ?, ?, ?, ?, ?)",
+            (job.kind, json.dumps(job.payload), job.priority, job.dedup_key, job.run_at, job.max_attempts),
+        )
+        if cursor.rowcount == 0:
+            return False
+        job.id = cursor.lastrowid
+        return True
+
+    def _claim(self, not_after: float) -> Optional[Job]:
+        conn = self._connect()
+        now = time.time()
+        # Take the write lock first so two workers cannot claim the same row
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = now - self.lease_seconds
+            # A lapsed lease goes back to the queue unless that would queue its dedup_key twice:
+            # drop it when the key is already queued or a later lapsed job holds the same key
+            conn.execute(
+                "DELETE FROM jobs WHERE status = 'running' AND claimed_at < ? AND dedup_key IS NOT NULL AND ("
+                "dedup_key IN (SELECT dedup_key FROM jobs WHERE status = 'queued' AND dedup_key IS NOT NULL) "
+                "OR id < (SELECT MAX(later.id) FROM jobs later WHERE later.dedup_key = jobs.dedup_key "
+                "AND later.status = 'running' AND later.claimed_at < ?))",
+                (expired, expired),
+            )
+            conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND claimed_at < ?", (expired,))
+            if now - self._pruned_at >= 60:
+                # Rows of older versions have no failed_at; they expire a retention period from now
+                conn.execute("UPDATE jobs SET failed_at = ? WHERE status = 'failed' AND failed_at IS NULL", (now,))
+                conn.execute("DELETE FROM jobs WHERE status = 'failed' AND failed_at < ?", (now - self.failed_retention,))
+                self._pruned_at = now
+            row = conn.execute(
+                "SELECT id, kind, payload, priority, dedup_key, run_at, attempts, max_attempts, last_error FROM jobs "
+                "WHERE status = 'queued' AND run_at <= ? ORDER BY priority, run_at, id LIMIT 1",
+                (not_after,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, claimed_at = ? WHERE id = ?",
+                (now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return Job(
+            id=row[0], kind=row[1], payload=json.loads(row[2]), priority=row[3], dedup_key=row[4],
+            run_at=row[5], attempts=row[6] + 1, max_attempts=row[7], last_error=row[8],
+        )
+
+    def _execute(self, sql: str, params: tuple):
+        self._connect().execute(sql, params)
+
+    def _counts(self) -> dict:
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {"queued": 0, "running": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def _retry(self, job: Job, run_at: float, error: str):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', run_at = ?, last_error = ?, claimed_at = NULL WHERE id = ?",
+                (run_at, error, job.id),
+            )
+        except sqlite3.IntegrityError:
+            # A newer job for the same key is already queued and makes this retry redundant
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def enqueue(self, job: Job) -> bool:
+        return await self._call(self._enqueue, job)
+
+    async def claim(self, not_after: float) -> Optional[Job]:
+        return await self._call(self._claim, not_after)
+
+    async def complete(self, job: Job):
+        await self._call(self._execute, "DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    async def retry(self, job: Job, run_at: float, error: str):
+        await self._call(self._retry, job, run_at, error)
+
+    async def fail(self, job: Job, error: str):
+        await self._call(
+            self._execute,
+            "UPDATE jobs SET status = 'failed', last_error = ?, claimed_at = NULL, failed_at = ? WHERE id = ?",
+            (error, time.time(), job.id),
+        )
+
+    async def counts(self) -> dict:
+        return await self._call(self._counts)
+
+    async def close(self):
+        await self._call(self._close)
+
+class JobQueue:
+    """
+    Runs background work such as titles and summaries on a few worker tasks.
+    Jobs rank below interactive chat: while busy() reports load, only jobs
+    that have waited max_defer seconds are started. Failed jobs are retried
+    with exponential backoff up to their max_attempts.
+    """
+
+    def __init__(
+        self,
+        broker: Broker,
+        workers: int,
+        max_attempts: int,
+        retry_base: float,
+        poll_interval: float,
+        max_defer: float,
+        busy: Callable[[], bool] = lambda: False,
+    ):
+        self.broker = broker
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.poll_interval = poll_interval
+        self.max_defer = max_defer
+        self.busy = busy
+        self._handlers: Dict[str, Callable[..., Awaitable]] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.deferred = 0
+
+    def register(self, kind: str, handler: Callable[..., Awaitable]):
+        """handler(**payload) runs the job; raising schedules a retry."""
+        self._handlers[kind] = handler
+
+    async def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        priority: int = PRIORITY_DEFAULT,
+        dedup_key: Optional[str] = None,
+        delay: float = 0.0,
+    ) -> bool:
+        """Queue a job; False if one with the same dedup_key is already waiting."""
+        job = Job(kind=kind, payload=payload, priority=priority, dedup_key=dedup_key,
+                  run_at=time.time() + delay, max_attempts=self.max_attempts)
+        if not await self.broker.enqueue(job):
+            self.deduplicated += 1
+            return False
+        self.enqueued += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.broker.close()
+
+    async def _worker(self):
+        while True:
+            try:
+                now = time.time()
+                if self.busy():
+                    # Interactive replies first; only jobs that waited long enough go ahead
+                    job = await self.broker.claim(now - self.max_defer)
+                    if job is None:
+                        self.deferred += 1
+                else:
+                    job = await self.broker.claim(now)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Error claiming job")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # A broker error must not end the worker; an unrecorded job runs again when its lease expires
+                logger.exception("Error finishing job %s", job.kind)
+
+    async def _run(self, job: Job):
+        handler = self._handlers.get(job.kind)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind {job.kind!r}")
+            await handler(**job.payload)
+        except asyncio.CancelledError:
+            # Shutting down: the lease expires and the job runs again later
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job.attempts < job.max_attempts and handler is not None:
+                delay = self.retry_base * 2 ** (job.attempts - 1) * random.uniform(0.8, 1.2)
+                self.retried += 1
+                jobs_total.inc(kind=job.kind, outcome="retry")
+                logger.info("Job %s attempt %d failed, retrying in %.1fs: %s", job.kind, job.attempts, delay, error)
+                await self.broker.retry(job, time.time() + delay, error)
+            else:
+                self.failed += 1
+                jobs_total.inc(kind=job.kind, outcome="failed")
+                logger.error("Job %s failed after %d attempts: %s", job.kind, job.attempts, error)
+                await self.broker.fail(job, error)
+            return
+        self.completed += 1
+        jobs_total.inc(kind=job.kind, outcome="ok")
+        job_seconds.observe(time.perf_counter() - started, kind=job.kind)
+        await self.broker.complete(job)
+
+    async def stats(self) -> dict:
+        return {
+            **await self.broker.counts(),
+            "workers": self.workers,
+            "busy": self.busy(),
+            "enqueued": self.enqueued,
+            "deduplicated": self.deduplicated,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed_total": self.failed,
+            "deferred_polls": self.deferred,
+        }
+
+def _make_broker() -> Broker:
+    if settings.JOB_BROKER == "memory":
+        return InMemoryBroker()
+    return SQLiteBroker(settings.JOB_DB_PATH, settings.JOB_LEASE_SECONDS, settings.JOB_FAILED_RETENTION)
+
+def _interactive_load() -> bool:
+    # Imported here: the registry pulls in the database layer
+    from app.services.stream_registry import stream_registry
+    return stream_registry.active_count() >= settings.JOB_DEFER_ABOVE_STREAMS
+
+job_queue = JobQueue(
+    broker=_make_broker(),
+    workers=settings.JOB_WORKERS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    retry_base=settings.JOB_RETRY_BASE,
+    poll_interval=settings.JOB_POLL_INTERVAL,
+    max_defer=settings.JOB_MAX_DEFER,
+    busy=_interactive_load,
+)
@@ -0,0 +1,110 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from app.core.config import settings
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as seen by request handlers: a read-only snapshot of the User row."""
+    id: int
+    username: str
+    email: str
+    is_active: bool
+    avatar_url: Optional[str] = None
+    bio: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            is_active=user.is_active,
+            avatar_url=user.avatar_url,
+            bio=user.bio,
+        )
+
+class PrincipalCache:
+    """
+    Verified principals keyed by access token, so authenticated requests skip
+    the user query. Entries expire after ttl seconds or when their token does,
+    whichever comes first; the least recently used are evicted beyond
+    max_entries. Per process: other workers see a change once their entry
+    expires. Not thread-safe; use it from the event loop only.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict() # token -> (principal, expires_at)
+        self._tokens_by_user = {} # user id -> set of tokens
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        principal, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self._remove(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return principal
+
+    def set(self, token: str, principal: Principal, token_expires_at: Optional[float] = None):
+        """token_expires_at is the token's exp claim (Unix time)."""
+        ttl = self.ttl
+        if token_expires_at is not None:
+            ttl = min(ttl, token_expires_at - time.time())
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        self._remove(token)
+        self._entries[token] = (principal, time.monotonic() + ttl)
+        self._tokens_by_user.setdefault(principal.id, set()).add(token)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[0].id]
+
+    def invalidate_user(self, user_id: int):
+        """Drop every cached token of a user, e.g. after their profile changed."""
+        for token in list(self._tokens_by_user.get(user_id, ())):
+            self._remove(token)
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "users": len(self._tokens_by_user),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_TTL, settings.PRINCIPAL_CACHE_MAX_ENTRIES)
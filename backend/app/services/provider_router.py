@@ -0,0 +1,299 @@
+import asyncio
+import time
+from typing import AsyncIterator, Dict, List, Optional
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.tokens import estimate_tokens
+
+llm_requests = registry.counter(
+    "llm_requests_total", "Model requests by provider and outcome (ok, error, timeout, unavailable, broken)",
+    ["provider", "model", "outcome"],
+)
+llm_first_token = registry.histogram("llm_time_to_first_token_seconds", "Time from request to first token", ["provider", "model"])
+llm_stream_duration = registry.histogram("llm_stream_duration_seconds", "Time from request to last token", ["provider", "model"])
+llm_tokens_per_second = registry.histogram(
+    "llm_tokens_per_second", "Estimated tokens per second after the first token", ["provider", "model"],
+    buckets=(1, 5, 10, 20, 40, 60, 80, 120, 160, 240, 320),
+)
+llm_completion_tokens = registry.counter("llm_completion_tokens_total", "Estimated tokens received", ["provider", "model"])
+llm_fallbacks = registry.counter("llm_fallbacks_total", "Requests answered by a fallback model", ["model", "fallback"])
+
+def _configured_models() -> set:
+    models = set(settings.MODEL_PROVIDERS) | set(settings.MODEL_FALLBACKS) | set(settings.MODEL_CONTEXT_BUDGETS)
+    models |= set(settings.VISION_IMAGE_MAX_SIDE) | {settings.CONTEXT_SUMMARY_MODEL}
+    for fallbacks in settings.MODEL_FALLBACKS.values():
+        models.update(fallbacks)
+    return models
+
+class ProviderError(Exception):
+    """No provider produced a reply, or the reply broke off after it started."""
+
+class ProviderUnavailable(Exception):
+    # Internal: the breaker is open or no slot came free; try the next candidate
+    pass
+
+class Provider:
+    """
+    One upstream API. At most max_concurrency requests run at once. Time to
+    first token and the error rate are tracked as moving averages. After
+    PROVIDER_BREAKER_ERRORS failures in a row the breaker opens and the
+    provider is skipped for PROVIDER_BREAKER_COOLDOWN seconds; then a single
+    probe request decides whether it closes again.
+    """
+
+    def __init__(self, name: str, client, max_concurrency: int):
+        self.name = name
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.ttft: Optional[float] = None # Seconds, moving average
+        self.error_rate = 0.0 # Moving average of failed requests
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._probing = False
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.consecutive_failures < settings.PROVIDER_BREAKER_ERRORS:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half-open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self._probing)
+
+    async def acquire(self):
+        if not self.available():
+            self.rejected += 1
+            raise ProviderUnavailable(f"{self.name}: circuit open")
+        if self.state == "half-open":
+            self._probing = True
+        try:
+            await asyncio.wait_for(self._slots.acquire(), settings.PROVIDER_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._probing = False
+            self.rejected += 1
+            raise ProviderUnavailable(f"{self.name}: all {self.max_concurrency} slots busy")
+        self.in_flight += 1
+        self.requests += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+        if self._probing:
+            # The probe ended without a verdict: cancelled, or its reader went away.
+            # Count it as failed, or the provider would stay half-open with a probe that never finishes.
+            self.record_failure()
+
+    def _average(self, current: Optional[float], sample: float) -> float:
+        alpha = settings.PROVIDER_EWMA_ALPHA
+        return sample if current is None else (1 - alpha) * current + alpha * sample
+
+    def record_first_token(self, seconds: float):
+        self.ttft = self._average(self.ttft, seconds)
+
+    def record_success(self):
+        self.error_rate = self._average(self.error_rate, 0.0)
+        self.consecutive_failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.error_rate = self._average(self.error_rate, 1.0)
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.consecutive_failures >= settings.PROVIDER_BREAKER_ERRORS:
+            self.open_until = time.monotonic() + settings.PROVIDER_BREAKER_COOLDOWN
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "ttft_ms": self.ttft * 1000 if self.ttft is not None else None,
+            "error_rate": self.error_rate,
+            "consecutive_failures": self.consecutive_failures,
+            "requests": self.requests,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+class ProviderRouter:
+    """
+    Sends each request to the provider serving its model, or to a configured
+    fallback model (MODEL_FALLBACKS) when that provider is failing, its
+    breaker is open or it has no free slot. A request is only moved before
+    its first token: once text has gone out, a failure raises ProviderError.
+    Healthy fallbacks are tried fastest first.
+    """
+
+    def __init__(self, clients: Dict[str, object]):
+        self.providers = {
+            name: Provider(name, client, settings.PROVIDER_MAX_CONCURRENCY.get(name, settings.PROVIDER_DEFAULT_CONCURRENCY))
+            for name, client in clients.items()
+        }
+        self.fallbacks = 0
+        # Metric label values; the model name comes from the client, so unknown ones share one series
+        self.known_models = _configured_models()
+
+    def model_label(self, model: str) -> str:
+        return model if model in self.known_models else "other"
+
+    def provider_for(self, model: str) -> Optional[Provider]:
+        name = settings.MODEL_PROVIDERS.get(model)
+        if name is None:
+            lowered = model.lower()
+            name = next((provider for provider in self.providers if provider in lowered), None)
+        if name is not None:
+            return self.providers.get(name)
+        # Default to qwen if available, else deepseek
+        return self.providers.get("qwen") or self.providers.get("deepseek")
+
+    def candidates(self, model: str) -> List[tuple]:
+        """(model, provider) pairs to try in order: the requested model, then its fallbacks."""
+        primary = [(model, self.provider_for(model))]
+        fallbacks = [(fallback, self.provider_for(fallback)) for fallback in settings.MODEL_FALLBACKS.get(model, [])]
+        fallbacks = [(name, provider) for name, provider in fallbacks if provider is not None]
+        # Unmeasured providers sort first so they get measured
+        fallbacks.sort(key=lambda pair: (not pair[1].available(), pair[1].ttft or 0.0))
+        return [(name, provider) for name, provider in primary + fallbacks if provider is not None]
+
+    async def stream(self, messages: list, model: str, **params) -> AsyncIterator[str]:
+        """Yield the reply's text; raises ProviderError if no candidate could start one."""
+        errors = []
+        candidates = self.candidates(model)
+        for attempt, (candidate_model, provider) in enumerate(candidates):
+            labels = {"provider": provider.name, "model": self.model_label(candidate_model)}
+            try:
+                await provider.acquire()
+            except ProviderUnavailable as e:
+                llm_requests.inc(outcome="unavailable", **labels)
+                errors.append(str(e))
+                continue
+            started = time.monotonic()
+            upstream = None
+            first = None
+            try:
+                try:
+                    upstream = await provider.client.chat.completions.create(
+                        model=candidate_model, messages=messages, stream=True, **params
+                    )
+                    chunks = upstream.__aiter__()
+                    first = await asyncio.wait_for(_next_text(chunks), settings.PROVIDER_FIRST_TOKEN_TIMEOUT)
+                except (Exception, asyncio.TimeoutError) as e:
+                    provider.record_failure()
+                    llm_requests.inc(outcome="timeout" if isinstance(e, asyncio.TimeoutError) else "error", **labels)
+                    errors.append(f"{provider.name}: {_describe(e)}")
+                    continue
+                first_at = time.monotonic()
+                provider.record_first_token(first_at - started)
+                llm_first_token.observe(first_at - started, **labels)
+                if attempt > 0:
+                    self.fallbacks += 1
+                    llm_fallbacks.inc(model=self.model_label(model), fallback=self.model_label(candidate_model))
+                parts = []
+                if first is not None:
+                    parts.append(first)
+                    yield first
+                    try:
+                        while True:
+                            text = await _next_text(chunks)
+                            if text is None:
+                                break
+                            parts.append(text)
+                            yield text
+                    except Exception as e:
+                        provider.record_failure()
+                        llm_requests.inc(outcome="broken", **labels)
+                        raise ProviderError(f"{provider.name}: {_describe(e)}") from e
+                provider.record_success()
+                finished = time.monotonic()
+                tokens = estimate_tokens("".join(parts))
+                llm_requests.inc(outcome="ok", **labels)
+                llm_stream_duration.observe(finished - started, **labels)
+                llm_completion_tokens.inc(tokens, **labels)
+                if finished > first_at:
+                    llm_tokens_per_second.observe(tokens / (finished - first_at), **labels)
+                return
+            finally:
+                if upstream is not None:
+                    await _aclose(upstream)
+                provider.release()
+        if not candidates:
+            errors.append(f"no provider configured for {model}")
+        raise ProviderError("; ".join(errors))
+
+    async def complete(self, messages: list, model: str, **params) -> str:
+        """The whole reply from the first candidate that answers; raises ProviderError otherwise."""
+        errors = []
+        candidates = self.candidates(model)
+        for attempt, (candidate_model, provider) in enumerate(candidates):
+            labels = {"provider": provider.name, "model": self.model_label(candidate_model)}
+            try:
+                await provider.acquire()
+            except ProviderUnavailable as e:
+                llm_requests.inc(outcome="unavailable", **labels)
+                errors.append(str(e))
+                continue
+            started = time.monotonic()
+            try:
+                try:
+                    response = await asyncio.wait_for(
+                        provider.client.chat.completions.create(model=candidate_model, messages=messages, **params),
+                        settings.PROVIDER_FIRST_TOKEN_TIMEOUT,
+                    )
+                except (Exception, asyncio.TimeoutError) as e:
+                    provider.record_failure()
+                    llm_requests.inc(outcome="timeout" if isinstance(e, asyncio.TimeoutError) else "error", **labels)
+                    errors.append(f"{provider.name}: {_describe(e)}")
+                    continue
+                elapsed = time.monotonic() - started
+                provider.record_first_token(elapsed)
+                # Before release(), which would count a probe still marked as running as failed
+                provider.record_success()
+            finally:
+                provider.release()
+            text = response.choices[0].message.content or ""
+            llm_requests.inc(outcome="ok", **labels)
+            llm_stream_duration.observe(elapsed, **labels)
+            llm_completion_tokens.inc(estimate_tokens(text), **labels)
+            if attempt > 0:
+                self.fallbacks += 1
+                llm_fallbacks.inc(model=self.model_label(model), fallback=self.model_label(candidate_model))
+            return text
+        if not candidates:
+            errors.append(f"no provider configured for {model}")
+        raise ProviderError("; ".join(errors))
+
+    def stats(self) -> dict:
+        return {
+            "fallbacks": self.fallbacks,
+            "providers": {name: provider.stats() for name, provider in self.providers.items()},
+        }
+
+async def _next_text(chunks) -> Optional[str]:
+    """The next non-empty piece of text from an OpenAI stream's iterator, or None at its end."""
+    while True:
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+        if chunk.choices and chunk.choices[0].delta.content:
+            return chunk.choices[0].delta.content
+
+def _describe(error: BaseException) -> str:
+    if isinstance(error, asyncio.TimeoutError):
+        return "timed out"
+    return str(error) or type(error).__name__
+
+async def _aclose(upstream):
+    close = getattr(upstream, "close", None) or getattr(upstream, "aclose", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception:
+            pass
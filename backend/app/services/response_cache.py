@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Optional
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.tokens import estimate_tokens
+
+def _normalize(messages: list) -> list:
+    """Messages reduced to what the model sees: roles and content, with outer whitespace trimmed."""
+    normalized = []
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, str):
+            content = content.strip()
+        elif isinstance(content, list):
+            content = [
+                {"type": "text", "text": part.get("text", "").strip()} if part.get("type") == "text" else part
+                for part in content
+            ]
+        normalized.append({"role": msg.get("role"), "content": content})
+    return normalized
+
+class ResponseCache:
+    """
+    Exact-match cache of model replies, keyed by a hash of the model, the
+    normalized messages and the request parameters. Opt-in per endpoint
+    (LLM_CACHE_ENDPOINTS); only replies that completed without error are
+    stored. Entries expire after ttl seconds and the least recently used are
+    evicted beyond max_bytes. Not thread-safe; use it from the event loop only.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.ttl = ttl
+        self.entries = LRUCache(max_bytes, sizeof=lambda entry: len(entry[0].encode("utf-8")))
+        self._endpoints: dict[str, dict] = {}
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+
+    def enabled(self, endpoint: Optional[str]) -> bool:
+        return endpoint is not None and settings.LLM_CACHE_ENDPOINTS.get(endpoint, False)
+
+    def key_for(self, model: str, messages: list, **params) -> str:
+        payload = json.dumps(
+            {"model": model, "messages": _normalize(messages), "params": params},
+            sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _counters(self, endpoint: str) -> dict:
+        return self._endpoints.setdefault(endpoint, {"hits": 0, "misses": 0, "stored": 0})
+
+    def get(self, key: str, endpoint: str) -> Optional[str]:
+        counters = self._counters(endpoint)
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() >= entry[1]:
+            self.entries.pop(key)
+            entry = None
+        if entry is None:
+            counters["misses"] += 1
+            return None
+        text, _, prompt_tokens = entry
+        counters["hits"] += 1
+        self.saved_prompt_tokens += prompt_tokens
+        self.saved_completion_tokens += estimate_tokens(text)
+        return text
+
+    def set(self, key: str, endpoint: str, messages: list, text: str):
+        if not text:
+            return
+        prompt_tokens = sum(estimate_tokens(msg.get("content")) for msg in messages)
+        self.entries.set(key, (text, time.monotonic() + self.ttl, prompt_tokens))
+        self._counters(endpoint)["stored"] += 1
+
+    async def replay(self, text: str):
+        """Yield a cached reply in chunks, as a live stream would arrive."""
+        size = max(1, settings.LLM_CACHE_REPLAY_CHUNK_CHARS)
+        for start in range(0, len(text), size):
+            yield text[start:start + size]
+            await asyncio.sleep(settings.LLM_CACHE_REPLAY_DELAY)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        endpoints = {}
+        for endpoint, counters in self._endpoints.items():
+            lookups = counters["hits"] + counters["misses"]
+            endpoints[endpoint] = {
+                **counters,
+                "enabled": self.enabled(endpoint),
+                "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+            }
+        return {
+            **self.entries.stats(),
+            "ttl": self.ttl,
+            "saved_prompt_tokens": self.saved_prompt_tokens,
+            "saved_completion_tokens": self.saved_completion_tokens,
+            "endpoints": endpoints,
+        }
+
+response_cache = ResponseCache(settings.LLM_CACHE_BYTES, settings.LLM_CACHE_TTL)
@@ -0,0 +1,220 @@
+import html
+import re
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Around matches in snippets; control characters cannot occur in escaped HTML
+MARK_START, MARK_END = "\x02", "\x03"
+# The trigram index only finds terms of at least this many characters
+MIN_TRIGRAM_CHARS = 3
+EXCERPT_CHARS = 160
+# Letters and digits, as split by search_bigrams()
+WORD_RUN = re.compile(r'[^\W_]+')
+
+class SearchQueryError(ValueError):
+    pass
+
+def _terms(query: str) -> list[str]:
+    return [term for term in query.split() if term][:16]
+
+def _fts_phrase(term: str) -> str:
+    # Quoted, so FTS5 operators and punctuation in the query are plain text
+    return '"' + term.replace('"', '""') + '"'
+
+def _bigram_match(terms: list[str]) -> str:
+    """FTS5 query over the bigram tables of migration 7; empty if no term has a letter or digit."""
+    parts = []
+    for term in terms:
+        for run in WORD_RUN.findall(term.lower()):
+            if len(run) == 1:
+                # A lone character is indexed as the start of a pair or as the end of a run
+                parts.append(_fts_phrase(run) + "*")
+            else:
+                parts.extend(_fts_phrase(run[i:i + 2]) for i in range(len(run) - 1))
+    return " ".join(parts)
+
+def _like_pattern(term: str) -> str:
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def _marked_html(snippet: str) -> str:
+    """Escape a snippet for HTML and turn the match markers into <mark> tags."""
+    return html.escape(snippet).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+def _excerpt(content: str, terms: list[str]) -> str:
+    """A window of content around the first match, with every match marked."""
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    first = pattern.search(content)
+    start = max(0, first.start() - EXCERPT_CHARS // 4) if first else 0
+    window = content[start:start + EXCERPT_CHARS]
+    marked = pattern.sub(lambda match: f"{MARK_START}{match.group(0)}{MARK_END}", window)
+    return ("…" if start > 0 else "") + marked + ("…" if start + EXCERPT_CHARS < len(content) else "")
+
+class SearchService:
+    """
+    Ranked search over a user's messages and session titles. On SQLite it
+    uses the FTS5 trigram indexes of migration 6, which triggers keep in
+    step with every write. Terms under three characters, which a trigram
+    index cannot look up, narrow its matches with LIKE; a query made only
+    of such terms uses the bigram indexes of migration 7 instead. On
+    PostgreSQL it uses the to_tsvector('simple', ...) expression indexes of
+    the same migration. Snippets are only built for the page returned.
+    """
+
+    async def search(self, db: AsyncSession, user_id: int, query: str, limit: int, offset: int) -> tuple[list[dict], bool]:
+        """One page of hits, best first, and whether there are more."""
+        terms = _terms(query)
+        if not terms:
+            return [], False
+        postgres = db.get_bind().dialect.name == "postgresql"
+        if postgres:
+            rows = await self._page_postgres(db, user_id, query, limit + 1, offset)
+        else:
+            rows = await self._page_sqlite(db, user_id, terms, limit + 1, offset)
+        more = len(rows) > limit
+        hits = [dict(row._mapping) for row in rows[:limit]]
+        if postgres:
+            snippets = await self._snippets_postgres(db, hits, query)
+        else:
+            snippets = await self._snippets_sqlite(db, hits, terms)
+        for hit in hits:
+            hit["snippet"] = _marked_html(snippets.get((hit["kind"], hit["id"]), ""))
+        return hits, more
+
+    def _sqlite_filters(self, terms: list[str], column: str) -> tuple[str, dict]:
+        short = [term for term in terms if len(term) < MIN_TRIGRAM_CHARS]
+        params = {f"short{i}": _like_pattern(term) for i, term in enumerate(short)}
+        clauses = "".join(f" AND {column} LIKE :short{i} ESCAPE '\\'" for i in range(len(short)))
+        return clauses, params
+
+    async def _page_sqlite(self, db: AsyncSession, user_id: int, terms: list[str], limit: int, offset: int):
+        long_terms = [term for term in terms if len(term) >= MIN_TRIGRAM_CHARS]
+        message_filter, params = self._sqlite_filters(terms, "m.content")
+        title_filter, _ = self._sqlite_filters(terms, "s.title")
+        params.update(user_id=user_id, limit=limit, offset=offset)
+        if long_terms:
+            params["match"] = " ".join(_fts_phrase(term) for term in long_terms)
+            messages_index, sessions_index = "chat_messages_fts", "chat_sessions_fts"
+        else:
+            params["match"] = _bigram_match(terms)
+            if not params["match"]:
+                raise SearchQueryError("Search for at least one letter or digit")
+            messages_index, sessions_index = "chat_messages_bigrams", "chat_sessions_bigrams"
+        # bm25() is lower for better matches. Its scale depends on the table's statistics,
+        # so each source is scaled to its own best match before the two are merged.
+        sql = f"""
+            SELECT kind, id, session_id, session_title, role, created_at,
+                   coalesce(raw / nullif(MAX(raw) OVER (), 0), 0) AS score
+            FROM (
+                SELECT 'message' AS kind, m.id AS id, m.session_id AS session_id, s.title AS session_title,
+                       m.role AS role, m.created_at AS created_at, -bm25({messages_index}) AS raw
+                FROM {messages_index}
+                JOIN chat_messages m ON m.id = {messages_index}.rowid
+                JOIN chat_sessions s ON s.id = m.session_id
+                WHERE {messages_index} MATCH :match AND s.user_id = :user_id{message_filter}
+            ) messages
+            UNION ALL
+            SELECT kind, id, session_id, session_title, role, created_at,
+                   coalesce(raw / nullif(MAX(raw) OVER (), 0), 0)
+            FROM (
+                SELECT 'session' AS kind, s.id AS id, s.id AS session_id, s.title AS session_title,
+                       NULL AS role, s.updated_at AS created_at, -bm25({sessions_index}) AS raw
+                FROM {sessions_index}
+                JOIN chat_sessions s ON s.id = {sessions_index}.rowid
+                WHERE {sessions_index} MATCH :match AND s.user_id = :user_id{title_filter}
+            ) sessions
+            ORDER BY score DESC, created_at DESC
+            LIMIT :limit OFFSET :offset
+        """
+        return (await db.execute(text(sql).columns(created_at=DateTime), params)).all()
+
+    async def _snippets_sqlite(self, db: AsyncSession, hits: list[dict], terms: list[str]) -> dict:
+        message_ids = [hit["id"] for hit in hits if hit["kind"] == "message"]
+        session_ids = [hit["id"] for hit in hits if hit["kind"] == "session"]
+        snippets = {}
+        long_terms = [term for term in terms if len(term) >= MIN_TRIGRAM_CHARS]
+        if not long_terms:
+            if message_ids:
+                rows = await db.execute(
+                    text("SELECT id, content FROM chat_messages WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                    {"ids": message_ids},
+                )
+                snippets.update((("message", row_id), _excerpt(content or "", terms)) for row_id, content in rows)
+            for hit in hits:
+                if hit["kind"] == "session":
+                    snippets[("session", hit["id"])] = _excerpt(hit["session_title"] or "", terms)
+            return snippets
+
+        match = " ".join(_fts_phrase(term) for term in long_terms)
+        if message_ids:
+            rows = await db.execute(
+                text(
+                    "SELECT rowid, snippet(chat_messages_fts, 0, :start, :end, '…', 64) FROM chat_messages_fts "
+                    "WHERE chat_messages_fts MATCH :match AND rowid IN :ids"
+                ).bindparams(bindparam("ids", expanding=True)),
+                {"start": MARK_START, "end": MARK_END, "match": match, "ids": message_ids},
+            )
+            snippets.update((("message", row_id), snippet) for row_id, snippet in rows)
+        if session_ids:
+            rows = await db.execute(
+                text(
+                    "SELECT rowid, highlight(chat_sessions_fts, 0, :start, :end) FROM chat_sessions_fts "
+                    "WHERE chat_sessions_fts MATCH :match AND rowid IN :ids"
+                ).bindparams(bindparam("ids", expanding=True)),
+                {"start": MARK_START, "end": MARK_END, "match": match, "ids": session_ids},
+            )
+            snippets.update((("session", row_id), snippet) for row_id, snippet in rows)
+        return snippets
+
+    async def _page_postgres(self, db: AsyncSession, user_id: int, query: str, limit: int, offset: int):
+        # ts_rank favours short documents such as titles, so each source is scaled to its own best match
+        sql = """
+            SELECT kind, id, session_id, session_title, role, created_at,
+                   coalesce(raw / nullif(MAX(raw) OVER (), 0), 0) AS score
+            FROM (
+                SELECT 'message' AS kind, m.id AS id, m.session_id AS session_id, s.title AS session_title,
+                       m.role AS role, m.created_at AS created_at,
+                       ts_rank(to_tsvector('simple', coalesce(m.content, '')), q) AS raw
+                FROM chat_messages m
+                JOIN chat_sessions s ON s.id = m.session_id,
+                     plainto_tsquery('simple', :query) q
+                WHERE to_tsvector('simple', coalesce(m.content, '')) @@ q AND s.user_id = :user_id
+                  AND m.status IS DISTINCT FROM 'streaming'
+            ) messages
+            UNION ALL
+            SELECT kind, id, session_id, session_title, role, created_at,
+                   coalesce(raw / nullif(MAX(raw) OVER (), 0), 0)
+            FROM (
+                SELECT 'session' AS kind, s.id AS id, s.id AS session_id, s.title AS session_title,
+                       NULL AS role, s.updated_at AS created_at,
+                       ts_rank(to_tsvector('simple', coalesce(s.title, '')), q) AS raw
+                FROM chat_sessions s, plainto_tsquery('simple', :query) q
+                WHERE to_tsvector('simple', coalesce(s.title, '')) @@ q AND s.user_id = :user_id
+            ) sessions
+            ORDER BY score DESC, created_at DESC
+            LIMIT :limit OFFSET :offset
+        """
+        params = {"query": query, "user_id": user_id, "limit": limit, "offset": offset}
+        return (await db.execute(text(sql).columns(created_at=DateTime), params)).all()
+
+    async def _snippets_postgres(self, db: AsyncSession, hits: list[dict], query: str) -> dict:
+        message_ids = [hit["id"] for hit in hits if hit["kind"] == "message"]
+        session_ids = [hit["id"] for hit in hits if hit["kind"] == "session"]
+        options = f"StartSel={MARK_START}, StopSel={MARK_END}, MaxWords=30, MinWords=10, MaxFragments=2"
+        snippets = {}
+        for kind, table, column, ids in (
+            ("message", "chat_messages", "content", message_ids),
+            ("session", "chat_sessions", "title", session_ids),
+        ):
+            if not ids:
+                continue
+            rows = await db.execute(
+                text(
+                    f"SELECT id, ts_headline('simple', coalesce({column}, ''), plainto_tsquery('simple', :query), :options) "
+                    f"FROM {table} WHERE id IN :ids"
+                ).bindparams(bindparam("ids", expanding=True)),
+                {"query": query, "options": options, "ids": ids},
+            )
+            snippets.update(((kind, row_id), snippet) for row_id, snippet in rows)
+        return snippets
+
+search_service = SearchService()
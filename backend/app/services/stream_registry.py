@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from sqlalchemy import update
+from app.core.config import settings
+from app.core.metrics import registry
+from app.db import models, database
+
+logger = logging.getLogger(__name__)
+
+streams_total = registry.counter("chat_streams_total", "Finished assistant replies by status", ["status"])
+
+class StreamFailedError(Exception):
+    """Raised to a listener when generation failed; the reply row has status "failed"."""
+
+class ChatStream:
+    """
+    An assistant reply being generated. The text is kept as UTF-8 bytes so a
+    client can resume from the number of bytes it has already received.
+    """
+
+    def __init__(self, message_id: int, session_id: int):
+        self.message_id = message_id
+        self.session_id = session_id
+        self.data = bytearray()
+        self.status = "streaming"
+        self.error: Optional[str] = None
+        self.listeners = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._idle_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status != "streaming"
+
+    @property
+    def text(self) -> str:
+        return self.data.decode("utf-8", errors="replace")
+
+    def _notify(self):
+        # Wake every waiting listener; later waits use a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+class StreamRegistry:
+    """
+    Runs each reply as a task independent of the request that started it.
+    The reply row is checkpointed while it streams; listeners follow it from
+    any offset, and generation is cancelled once nobody has listened for
+    STREAM_IDLE_GRACE seconds. Per process: a resume that reaches another
+    worker gets the last checkpoint from the database instead.
+    """
+
+    def __init__(self):
+        self._streams: dict[int, ChatStream] = {}
+        self.started = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.resumed = 0
+
+    def get(self, message_id: int) -> Optional[ChatStream]:
+        return self._streams.get(message_id)
+
+    def active_count(self) -> int:
+        return sum(1 for stream in self._streams.values() if not stream.done)
+
+    def start(
+        self,
+        message_id: int,
+        session_id: int,
+        chunks: AsyncIterator[str],
+        on_complete: Optional[Callable[[], Awaitable]] = None,
+    ) -> ChatStream:
+        stream = ChatStream(message_id, session_id)
+        self._streams[message_id] = stream
+        stream.task = asyncio.create_task(self._produce(stream, chunks, on_complete))
+        self.started += 1
+        # Cancelled unless someone starts listening
+        self._schedule_idle_cancel(stream)
+        return stream
+
+    def _attach(self, stream: ChatStream):
+        stream.listeners += 1
+        if stream._idle_timer is not None:
+            stream._idle_timer.cancel()
+            stream._idle_timer = None
+
+    def _detach(self, stream: ChatStream):
+        stream.listeners -= 1
+        if stream.listeners == 0 and not stream.done:
+            self._schedule_idle_cancel(stream)
+
+    async def first_output(self, stream: ChatStream):
+        """Wait until the reply has its first bytes or has ended."""
+        self._attach(stream)
+        try:
+            while not stream.data and not stream.done:
+                await stream._changed.wait()
+        finally:
+            self._detach(stream)
+
+    async def follow(self, stream: ChatStream, offset: int = 0, resumed: bool = False):
+        """
+        Yield the reply's bytes from offset on, as they are generated. If
+        generation fails, StreamFailedError is raised after the last bytes so
+        the response is cut off rather than looking complete.
+        """
+        self._attach(stream)
+        if resumed:
+            self.resumed += 1
+        try:
+            while True:
+                changed = stream._changed
+                if offset < len(stream.data):
+                    chunk = bytes(stream.data[offset:])
+                    offset += len(chunk)
+                    yield chunk
+                    continue
+                if stream.status == "failed":
+                    raise StreamFailedError(stream.error)
+                if stream.done:
+                    return
+                await changed.wait()
+        finally:
+            self._detach(stream)
+
+    def _schedule_idle_cancel(self, stream: ChatStream):
+        loop = asyncio.get_running_loop()
+        stream._idle_timer = loop.call_later(settings.STREAM_IDLE_GRACE, self._cancel_if_idle, stream)
+
+    def _cancel_if_idle(self, stream: ChatStream):
+        stream._idle_timer = None
+        if stream.listeners == 0 and not stream.done and stream.task is not None:
+            stream.task.cancel()
+
+    async def _save(self, stream: ChatStream, status: str):
+        try:
+            async with database.AsyncSessionLocal() as db:
+                await db.execute(
+                    update(models.ChatMessage).where(models.ChatMessage.id == stream.message_id).values(content=stream.text, status=status)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.exception("Error saving streamed message %d", stream.message_id)
+
+    async def _produce(self, stream: ChatStream, chunks: AsyncIterator[str], on_complete):
+        status = "failed"
+        pending = 0
+        checkpointed_at = time.monotonic()
+        try:
+            async for chunk in chunks:
+                stream.data += chunk.encode("utf-8")
+                stream._notify()
+                pending += len(chunk)
+                if pending >= settings.STREAM_CHECKPOINT_CHARS or time.monotonic() - checkpointed_at >= settings.STREAM_CHECKPOINT_SECONDS:
+                    await self._save(stream, "streaming")
+                    pending = 0
+                    checkpointed_at = time.monotonic()
+            status = "complete"
+        except asyncio.CancelledError:
+            status = "cancelled"
+        except Exception as e:
+            stream.error = str(e)
+            logger.warning("Error generating reply %d: %s", stream.message_id, e)
+        finally:
+            await _aclose(chunks)
+            # Saved first: a resume that sees the stream done reads the final row
+            await self._save(stream, status)
+            stream.status = status
+            stream._notify()
+            if stream._idle_timer is not None:
+                stream._idle_timer.cancel()
+            # Keep it a while for clients that reconnect just after the end
+            asyncio.get_running_loop().call_later(settings.STREAM_RETENTION, self._streams.pop, stream.message_id, None)
+
+        streams_total.inc(status=status)
+        if status == "complete":
+            self.completed += 1
+            if on_complete is not None:
+                try:
+                    await on_complete()
+                except Exception as e:
+                    logger.exception("Error after completing reply %d", stream.message_id)
+        elif status == "cancelled":
+            self.cancelled += 1
+        else:
+            self.failed += 1
+
+    async def close(self):
+        """Cancel generation on shutdown; partial replies are saved as cancelled."""
+        tasks = [stream.task for stream in self._streams.values() if stream.task is not None and not stream.done]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active_count(),
+            "listeners": sum(stream.listeners for stream in self._streams.values()),
+            "retained": len(self._streams),
+            "started": self.started,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "resumed": self.resumed,
+        }
+
+async def _aclose(chunks):
+    # Close the upstream generator now, so an abandoned HTTP stream is released
+    close = getattr(chunks, "aclose", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception:
+            pass
+
+stream_registry = StreamRegistry()
+
+registry.gauge("chat_streams_active", "Assistant replies being generated", collect=stream_registry.active_count)
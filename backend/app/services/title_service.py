@@ -0,0 +1,49 @@
+from sqlalchemy import select
+from app.core.config import settings
+from app.db import models, database
+from app.services.chat_service import chat_service
+
+DEFAULT_TITLE = "New Chat"
+TITLE_MODEL = "qwen-plus"
+
+def _clean(title: str) -> str:
+    return title.strip().strip('"').strip("'")
+
+class TitleService:
+    """Session titles written by the model. Run as background jobs; errors are raised so the job is retried."""
+
+    async def from_first_message(self, session_id: int, content: str):
+        """Title a new session from its first message, unless it was renamed meanwhile."""
+        prompt = f"Summarize the following user input into a short, concise title (max 5 words). Do not use quotes. Input: {content[:200]}"
+        title = _clean(await chat_service.chat_completion(
+            [{"role": "user", "content": prompt}], model=TITLE_MODEL, max_tokens=settings.TITLE_MAX_TOKENS, cache="title"
+        ))
+        if not title:
+            return
+        async with database.AsyncSessionLocal() as db:
+            session = await db.get(models.ChatSession, session_id)
+            if not session or session.title != DEFAULT_TITLE:
+                return
+            session.title = title
+            await db.commit()
+
+    async def from_conversation(self, session_id: int):
+        """Title a session from its first few messages, replacing the current title."""
+        async with database.AsyncSessionLocal() as db:
+            messages = (await db.scalars(
+                select(models.ChatMessage).where(models.ChatMessage.session_id == session_id).order_by(models.ChatMessage.created_at).limit(4)
+            )).all()
+            if not messages:
+                return
+            conversation = "\n".join([f"{msg.role}: {msg.content[:200]}" for msg in messages]) # Limit content
+            prompt = f"Summarize the following conversation into a short title (max 5 words):\n\n{conversation}"
+
+            title = _clean(await chat_service.chat_completion(
+                [{"role": "user", "content": prompt}], model=TITLE_MODEL, max_tokens=settings.TITLE_MAX_TOKENS, cache="title"
+            ))
+            session = await db.get(models.ChatSession, session_id)
+            if title and session:
+                session.title = title
+                await db.commit()
+
+title_service = TitleService()
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from app.core.cache import LRUCache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL used as the cache key."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    # The fragment never reaches the server, so it does not change the content
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+@dataclass
+class WebCacheEntry:
+    url: str
+    text: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fetched_at: float = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self.text.encode("utf-8")) + len(self.url) + 128
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.fetched_at < ttl
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class WebCache:
+    """
+    Extracted page text keyed by normalized URL: an in-memory LRU bounded by
+    bytes in front of a directory of JSON files. Bytes written are counted,
+    and the directory is pruned once it grows past disk_bytes. Disk access
+    runs in a thread.
+    """
+
+    # Pruning goes this far below the budget, so it does not run on every write
+    PRUNE_TO = 0.9
+
+    def __init__(self, directory: str, ttl: float, memory_bytes: int, disk_bytes: int):
+        self.directory = directory
+        self.ttl = ttl
+        self.disk_bytes = disk_bytes
+        self.disk_used: Optional[int] = None # Measured by prune_disk, then counted as entries are written
+        self._pruning = False
+        self.disk_prunes = 0
+        self.memory = LRUCache(memory_bytes, sizeof=lambda entry: entry.size)
+        self.disk_hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.refreshed = 0
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def _read(self, key: str) -> Optional[WebCacheEntry]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return WebCacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _write(self, key: str, entry: WebCacheEntry) -> int:
+        """Store an entry; returns the change in bytes on disk."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(asdict(entry), f, ensure_ascii=False)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        written = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        return written - replaced
+
+    async def get(self, key: str) -> Optional[WebCacheEntry]:
+        """Return the cached entry for a key, fresh or stale, or None."""
+        entry = self.memory.get(key)
+        if entry is None:
+            entry = await asyncio.to_thread(self._read, key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.memory.set(key, entry)
+        return entry
+
+    async def set(self, key: str, entry: WebCacheEntry):
+        self.memory.set(key, entry)
+        try:
+            written = await asyncio.to_thread(self._write, key, entry)
+        except OSError as e:
+            logger.warning("Error writing web cache entry: %s", e)
+            return
+        if self.disk_used is not None:
+            self.disk_used += written
+        if (self.disk_used is None or self.disk_used > self.disk_bytes) and not self._pruning:
+            self._pruning = True
+            try:
+                await asyncio.to_thread(self.prune_disk)
+            finally:
+                self._pruning = False
+
+    async def mark_revalidated(self, key: str, entry: WebCacheEntry):
+        """The origin answered 304: the stored text is current again."""
+        self.revalidated += 1
+        entry.fetched_at = time.time()
+        await self.set(key, entry)
+
+    def prune_disk(self):
+        """Delete the least recently written files once the store is over its byte budget, down to PRUNE_TO of it."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        files = []
+        total = 0
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total > self.disk_bytes:
+            self.disk_prunes += 1
+            files.sort()
+            for _, size, path in files:
+                if total <= self.disk_bytes * self.PRUNE_TO:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+        # Writes made while this ran are not counted; the next prune measures again
+        self.disk_used = total
+
+    def stats(self) -> dict:
+        hits = self.memory.hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "revalidated": self.revalidated,
+            "refreshed": self.refreshed,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.current_bytes,
+            "memory_max_bytes": self.memory.max_bytes,
+            "memory_evictions": self.memory.evictions,
+            "disk_bytes": self.disk_used,
+            "disk_max_bytes": self.disk_bytes,
+            "disk_prunes": self.disk_prunes,
+        }
+
+web_cache = WebCache(
+    directory=settings.WEB_CACHE_DIR,
+    ttl=settings.WEB_CACHE_TTL,
+    memory_bytes=settings.WEB_CACHE_MEMORY_BYTES,
+    disk_bytes=settings.WEB_CACHE_DISK_BYTES,
+)
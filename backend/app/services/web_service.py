@@ -1,12 +1,64 @@
+import asyncio
 import httpx
-from bs4 import BeautifulSoup
 import re
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import urlsplit
+from app.core.config import settings
+from app.core.media import is_text_mime, looks_binary
+from app.services.html_text import extract_text
+from app.services.web_cache import web_cache, normalize_url, WebCacheEntry
 
 class WebService:
     def __init__(self):
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
         }
+        self.client: Optional[httpx.AsyncClient] = None
+        self.cache = web_cache
+        # host -> [semaphore, number of fetches holding or waiting for it]
+        self._host_slots = {}
+
+    async def start(self):
+        """Open the shared, pooled HTTP client. Called from the app lifespan."""
+        self._get_client()
+        await asyncio.to_thread(self.cache.prune_disk)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily as well, so scripts that never run the lifespan still work
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=settings.WEB_FETCH_TIMEOUT,
+                headers=self.headers,
+                limits=httpx.Limits(
+                    max_connections=settings.WEB_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.WEB_MAX_CONNECTIONS,
+                ),
+            )
+        return self.client
+
+    @asynccontextmanager
+    async def _host_slot(self, url: str):
+        """Limit how many requests run against one host at the same time."""
+        host = urlsplit(url).netloc.lower()
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = [asyncio.Semaphore(settings.WEB_PER_HOST_CONCURRENCY), 0]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0:
+                del self._host_slots[host]
 
     def extract_urls(self, text: str) -> list[str]:
         """Extract URLs from text, excluding local uploads."""
@@ -15,35 +67,94 @@ class WebService:
         # Filter out local uploads
         return [url for url in urls if "localhost" not in url and "/uploads/" not in url]
 
+    async def fetch_all(self, urls: list[str], deadline: Optional[float] = None) -> list[str]:
+        """
+        Fetch several URLs concurrently. Fetches still running when the overall
+        deadline expires are cancelled and reported as timed out, so the caller
+        always gets one result per distinct URL.
+        """
+        if not urls:
+            return []
+        if deadline is None:
+            deadline = settings.WEB_FETCH_DEADLINE
+
+        async def fetch_limited(url):
+            async with self._host_slot(url):
+                return await self.fetch_content(url)
+
+        tasks = {url: asyncio.create_task(fetch_limited(url)) for url in dict.fromkeys(urls)}
+        done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        results = []
+        for url, task in tasks.items():
+            if task in done:
+                results.append(task.result())
+            else:
+                results.append(f"Error fetching {url}: timed out after {deadline:g}s\n")
+        return results
+
+    async def _read_body(self, response: httpx.Response) -> str:
+        """
+        Stream the response body up to WEB_MAX_BYTES, rejecting anything that is
+        not text as early as possible.
+        """
+        content_type = response.headers.get("content-type", "")
+        if content_type and not is_text_mime(content_type):
+            raise ValueError(f"Unsupported content type: {content_type.split(';')[0]}")
+
+        body = bytearray()
+        sniffed = False
+        async for chunk in response.aiter_bytes():
+            body += chunk
+            # Content types lie; check the first bytes before reading on
+            if not sniffed and len(body) >= 1024:
+                if looks_binary(bytes(body[:1024])):
+                    raise ValueError("Response body is not text")
+                sniffed = True
+            if len(body) >= settings.WEB_MAX_BYTES:
+                del body[settings.WEB_MAX_BYTES:]
+                break
+        if not sniffed and looks_binary(bytes(body[:1024])):
+            raise ValueError("Response body is not text")
+        return body.decode(response.encoding or "utf-8", errors="replace")
+
     async def fetch_content(self, url: str) -> str:
-        """Fetch and parse text content from a URL."""
+        """Fetch and parse text content from a URL, going through the web cache."""
         try:
-            async with httpx.AsyncClient(follow_redirects=True, timeout=10.0) as client:
-                response = await client.get(url, headers=self.headers)
+            key = normalize_url(url)
+            entry = await self.cache.get(key)
+            if entry is not None and entry.is_fresh(self.cache.ttl):
+                return f"URL: {url}\nContent:\n{entry.text}\n"
+
+            # Stale entries are revalidated with a conditional GET
+            request_headers = entry.conditional_headers() if entry is not None else {}
+            async with self._get_client().stream("GET", url, headers=request_headers) as response:
+                if response.status_code == 304 and entry is not None:
+                    await self.cache.mark_revalidated(key, entry)
+                    return f"URL: {url}\nContent:\n{entry.text}\n"
                 response.raise_for_status()
-                
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Remove script and style elements
-                for script in soup(["script", "style", "nav", "footer", "header"]):
-                    script.decompose()
-                
-                # Get text
-                text = soup.get_text()
-                
-                # Break into lines and remove leading/trailing space on each
-                lines = (line.strip() for line in text.splitlines())
-                # Break multi-headlines into a line each
-                chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                # Drop blank lines
-                text = '\n'.join(chunk for chunk in chunks if chunk)
-                
-                # Truncate if too long (to avoid token limits)
-                if len(text) > 10000:
-                    text = text[:10000] + "...(truncated)"
-                    
-                return f"URL: {url}\nContent:\n{text}\n"
-                
+                html = await self._read_body(response)
+
+            # Parsing is CPU bound, keep it off the event loop
+            text = await asyncio.to_thread(extract_text, html, settings.WEB_MAX_CHARS)
+
+            if "no-store" not in response.headers.get("cache-control", "").lower():
+                if entry is not None:
+                    self.cache.refreshed += 1
+                await self.cache.set(key, WebCacheEntry(
+                    url=key,
+                    text=text,
+                    etag=response.headers.get("etag"),
+                    last_modified=response.headers.get("last-modified"),
+                    fetched_at=time.time(),
+                ))
+
+            return f"URL: {url}\nContent:\n{text}\n"
+
         except Exception as e:
             return f"Error fetching {url}: {str(e)}\n"
 
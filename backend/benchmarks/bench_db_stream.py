@@ -0,0 +1,124 @@
+"""
+Token stream latency while other requests use the database, with the
+blocking Session the handlers used before and with the AsyncSession they
+use now.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_db_stream --streams 20 --db-clients 10 --seconds 5
+
+Each stream stands in for a reply being relayed to a user: it sends a token
+every --interval ms and records how late each one goes out. Meanwhile each
+DB client repeats what send_message does per turn: load the recent history
+of a large session, then insert a message and commit. A temporary SQLite
+database is seeded for the run, so the app's own database is not touched.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from app.db import models
+from app.db.database import async_database_url
+
+def seed(url: str, messages: int) -> int:
+    engine = create_engine(url)
+    models.Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        user = models.User(username="bench", email="bench@example.com", hashed_password="x")
+        session = models.ChatSession(title="bench", owner=user)
+        db.add(session)
+        db.flush()
+        db.add_all(
+            models.ChatMessage(session_id=session.id, role="user" if i % 2 == 0 else "assistant", content="lorem ipsum " * 100)
+            for i in range(messages)
+        )
+        db.commit()
+        session_id = session.id
+    engine.dispose()
+    return session_id
+
+def history_query(session_id: int):
+    return select(models.ChatMessage).where(models.ChatMessage.session_id == session_id).order_by(
+        models.ChatMessage.created_at.desc(), models.ChatMessage.id.desc()
+    ).limit(100)
+
+async def stream(interval: float, deadline: float, delays: list):
+    next_at = time.perf_counter() + interval
+    while next_at < deadline:
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        delays.append(time.perf_counter() - next_at)
+        next_at += interval
+
+async def sync_client(Session, session_id: int, deadline: float, ops: list):
+    # What the handlers did: blocking calls straight on the event loop
+    while time.perf_counter() < deadline:
+        with Session() as db:
+            db.scalars(history_query(session_id)).all()
+            db.add(models.ChatMessage(session_id=session_id, role="user", content="hello"))
+            db.commit()
+        ops.append(1)
+        await asyncio.sleep(0)
+
+async def async_client(Session, session_id: int, deadline: float, ops: list):
+    while time.perf_counter() < deadline:
+        async with Session() as db:
+            (await db.scalars(history_query(session_id))).all()
+            db.add(models.ChatMessage(session_id=session_id, role="user", content="hello"))
+            await db.commit()
+        ops.append(1)
+
+async def run(mode: str, url: str, session_id: int, args) -> dict:
+    if mode == "sync":
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+        Session = sessionmaker(bind=engine)
+        client = sync_client
+    else:
+        engine = create_async_engine(async_database_url(url))
+        Session = async_sessionmaker(engine, expire_on_commit=False)
+        client = async_client
+
+    delays = []
+    ops = []
+    deadline = time.perf_counter() + args.seconds
+    await asyncio.gather(
+        *(stream(args.interval / 1000, deadline, delays) for _ in range(args.streams)),
+        *(client(Session, session_id, deadline, ops) for _ in range(args.db_clients)),
+    )
+
+    if mode == "sync":
+        engine.dispose()
+    else:
+        await engine.dispose()
+    delays.sort()
+    return {
+        "p50": statistics.median(delays) * 1000,
+        "p99": delays[int(len(delays) * 0.99)] * 1000,
+        "max": delays[-1] * 1000,
+        "db_ops": len(ops) / args.seconds,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=20, help="Concurrent token streams")
+    parser.add_argument("--db-clients", type=int, default=10, help="Concurrent database clients")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duration of each run")
+    parser.add_argument("--interval", type=float, default=20.0, help="Milliseconds between tokens")
+    parser.add_argument("--messages", type=int, default=20000, help="Messages in the seeded session")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        session_id = seed(url, args.messages)
+        print(f"{args.streams} streams, {args.db_clients} DB clients, {args.seconds:g}s per run")
+        print(f"{'session':<10}{'late p50 ms':>14}{'late p99 ms':>14}{'late max ms':>14}{'DB ops/s':>12}")
+        for mode in ("sync", "async"):
+            result = asyncio.run(run(mode, url, session_id, args))
+            print(f"{mode:<10}{result['p50']:>14.2f}{result['p99']:>14.2f}{result['max']:>14.2f}{result['db_ops']:>12.1f}")
+
+if __name__ == "__main__":
+    main()
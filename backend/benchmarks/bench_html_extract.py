@@ -0,0 +1,87 @@
+"""
+Compare the streaming HTML text extractor with the previous BeautifulSoup path.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_html_extract --corpus path/to/saved/pages
+
+The corpus is a directory of saved .html/.htm files. Without one, a few
+synthetic pages (small article, large listing, 20 MB page) are generated.
+The baseline needs beautifulsoup4, which the app itself no longer uses.
+
+Both paths are timed twice: with the WEB_MAX_CHARS cap the app uses, where
+the streaming extractor stops early, and on the full document with no cap,
+which compares the parsing itself.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from app.core.config import settings
+from app.services.html_text import extract_text
+
+def bs4_extract(html: str, max_chars: int = 10000) -> str:
+    """The extraction WebService used before the streaming extractor."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for script in soup(["script", "style", "nav", "footer", "header"]):
+        script.decompose()
+    text = soup.get_text()
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    text = '\n'.join(chunk for chunk in chunks if chunk)
+    if len(text) > max_chars:
+        text = text[:max_chars] + "...(truncated)"
+    return text
+
+def synthetic_corpus() -> dict:
+    paragraph = "<p>Lorem ipsum dolor sit amet, <b>consectetur</b> adipiscing elit. 人工智能正在改变世界。</p>\n"
+    chrome = "<header><nav><a href='/'>Home</a></nav></header><script>var x = 1;</script><style>p{}</style>"
+    return {
+        "article-20KB": f"<html><head><title>Article</title></head><body>{chrome}{paragraph * 200}<footer>f</footer></body></html>",
+        "listing-1MB": f"<html><body>{chrome}" + "<div><ul>" + "<li><a href='#'>item</a> detail text</li>" * 25000 + "</ul></div></body></html>",
+        "huge-20MB": f"<html><body>{chrome}{paragraph * 200000}</body></html>",
+    }
+
+def load_corpus(directory: str) -> dict:
+    pages = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), "r", encoding="utf-8", errors="replace") as f:
+                pages[name] = f.read()
+    return pages
+
+def time_it(fn, html: str, max_chars: int, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(html, max_chars)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Directory of saved HTML pages")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    if not pages:
+        parser.error(f"No .html files found in {args.corpus}")
+
+    for title, max_chars in ((f"capped at {settings.WEB_MAX_CHARS} chars", settings.WEB_MAX_CHARS), ("full document", sys.maxsize)):
+        print(f"\n{title}")
+        print(f"{'page':<40} {'size':>10} {'bs4 ms':>10} {'fast ms':>10} {'speedup':>8}")
+        totals = [0.0, 0.0]
+        for name, html in pages.items():
+            slow = time_it(bs4_extract, html, max_chars, args.repeat)
+            fast = time_it(extract_text, html, max_chars, args.repeat)
+            totals[0] += slow
+            totals[1] += fast
+            print(f"{name[:40]:<40} {len(html) / 1024:>8.0f}KB {slow * 1000:>10.1f} {fast * 1000:>10.1f} {slow / fast:>7.1f}x")
+        print(f"{'total':<40} {'':>10} {totals[0] * 1000:>10.1f} {totals[1] * 1000:>10.1f} {totals[0] / totals[1]:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Login throughput and token stream latency during a burst of logins, with
+bcrypt run on the event loop (as the handlers did) and through the
+bounded PasswordHasher.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_login --logins 200 --concurrency 50 --streams 20
+
+Each stream sends a token every --interval ms and records how late each one
+goes out. The logins verify a password against a hash made with
+BCRYPT_ROUNDS, --concurrency at a time. With the hasher, logins beyond its
+queue are rejected at once (a 503 in the app) and counted separately.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from app.core import security
+from app.core.config import settings
+
+async def stream(interval: float, done: asyncio.Event, delays: list):
+    next_at = time.perf_counter() + interval
+    while not done.is_set():
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        delays.append(time.perf_counter() - next_at)
+        next_at += interval
+
+async def inline_login(hashed: str):
+    return security.verify_password("correct horse", hashed)
+
+async def hasher_login(hashed: str):
+    valid, _ = await security.password_hasher.verify_and_update("correct horse", hashed)
+    return valid
+
+async def run(login, hashed: str, args) -> dict:
+    delays = []
+    done = asyncio.Event()
+    streams = [asyncio.create_task(stream(args.interval / 1000, done, delays)) for _ in range(args.streams)]
+    limit = asyncio.Semaphore(args.concurrency)
+    accepted = 0
+    rejected = 0
+
+    async def one():
+        nonlocal accepted, rejected
+        async with limit:
+            try:
+                await login(hashed)
+                accepted += 1
+            except security.HashingBusyError:
+                rejected += 1
+                # A client told to retry later; keep the offered load steady
+                await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await asyncio.gather(*streams)
+
+    delays.sort()
+    return {
+        "logins": accepted / elapsed,
+        "rejected": rejected,
+        "p50": statistics.median(delays) * 1000 if delays else 0.0,
+        "p99": delays[int(len(delays) * 0.99)] * 1000 if delays else 0.0,
+        "max": delays[-1] * 1000 if delays else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200, help="Logins in the burst")
+    parser.add_argument("--concurrency", type=int, default=50, help="Logins in flight at once")
+    parser.add_argument("--streams", type=int, default=20, help="Concurrent token streams")
+    parser.add_argument("--interval", type=float, default=20.0, help="Milliseconds between tokens")
+    args = parser.parse_args()
+
+    hashed = security.get_password_hash("correct horse")
+    print(f"bcrypt rounds {settings.BCRYPT_ROUNDS}, {security.password_hasher.workers} hash workers, "
+          f"queue {security.password_hasher.queue_depth}; {args.logins} logins, {args.streams} streams")
+    print(f"{'bcrypt':<10}{'logins/s':>10}{'rejected':>10}{'late p50 ms':>14}{'late p99 ms':>14}{'late max ms':>14}")
+    for name, login in (("inline", inline_login), ("hasher", hasher_login)):
+        result = asyncio.run(run(login, hashed, args))
+        print(f"{name:<10}{result['logins']:>10.1f}{result['rejected']:>10}{result['p50']:>14.2f}{result['p99']:>14.2f}{result['max']:>14.2f}")
+    security.password_hasher.close()
+
+if __name__ == "__main__":
+    main()
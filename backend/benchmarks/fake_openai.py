@@ -0,0 +1,136 @@
+"""
+A stand-in for Qwen/DeepSeek: an OpenAI-compatible chat completions server
+with configurable latency, token rate and errors.
+
+Run from the backend directory:
+
+    python -m benchmarks.fake_openai --port 9100 --ttft 400 --tokens-per-second 40
+
+and point the app at it:
+
+    QWEN_BASE_URL=http://127.0.0.1:9100/v1 QWEN_API_KEY=fake uvicorn app.main:app
+
+Replies are streamed as server-sent events like the real APIs, or returned
+whole when stream is false. --error-rate fails that share of requests with
+a 500 before any token; --break-rate cuts that share of streams off midway.
+For chats with links, GET /page/{n} serves a small article.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while model servers stream tokens "
+    "to many users at once and the event loop keeps every reply moving"
+).split()
+
+def create_app(args) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    rng = random.Random(args.seed)
+    counters = {"requests": 0, "errors": 0, "broken": 0, "in_flight": 0}
+
+    def reply_tokens(max_tokens):
+        count = max(1, int(rng.gauss(args.reply_tokens, args.reply_tokens * 0.2)))
+        if max_tokens:
+            count = min(count, max_tokens)
+        return [rng.choice(WORDS) + " " for _ in range(count)]
+
+    async def first_token_delay():
+        jitter = rng.uniform(-args.ttft_jitter, args.ttft_jitter)
+        await asyncio.sleep(max(0.0, args.ttft + jitter) / 1000)
+
+    def chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+        body = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(body)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        counters["requests"] += 1
+        tokens = reply_tokens(body.get("max_tokens"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if rng.random() < args.error_rate:
+            await first_token_delay()
+            counters["errors"] += 1
+            return JSONResponse({"error": {"message": "injected failure", "type": "server_error"}}, status_code=500)
+
+        if not body.get("stream"):
+            await first_token_delay()
+            await asyncio.sleep(len(tokens) / args.tokens_per_second)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            }
+
+        break_at = rng.randrange(1, len(tokens) + 1) if rng.random() < args.break_rate else None
+
+        async def events():
+            counters["in_flight"] += 1
+            try:
+                await first_token_delay()
+                yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+                interval = 1 / args.tokens_per_second
+                next_at = time.perf_counter()
+                for i, token in enumerate(tokens):
+                    if break_at is not None and i == break_at:
+                        counters["broken"] += 1
+                        raise RuntimeError("injected stream break")
+                    yield chunk(completion_id, model, {"content": token})
+                    next_at += interval
+                    await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                yield chunk(completion_id, model, {}, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+            finally:
+                counters["in_flight"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": name, "object": "model"} for name in ("qwen-plus", "deepseek-chat")]}
+
+    @app.get("/page/{n}", response_class=HTMLResponse)
+    async def page(n: int):
+        paragraphs = "".join(f"<p>{' '.join(rng.choice(WORDS) for _ in range(60))}</p>" for _ in range(20))
+        return f"<html><head><title>Page {n}</title></head><body><article><h1>Page {n}</h1>{paragraphs}</article></body></html>"
+
+    @app.get("/stats")
+    async def stats():
+        return counters
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=400.0, help="Milliseconds before the first token")
+    parser.add_argument("--ttft-jitter", type=float, default=100.0, help="Uniform +/- milliseconds on --ttft")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="Per stream")
+    parser.add_argument("--reply-tokens", type=int, default=150, help="Mean reply length")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failed with a 500")
+    parser.add_argument("--break-rate", type=float, default=0.0, help="Share of streams cut off midway")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Capacity test of a running server with a mix of realistic requests:
+logins, session lists, history pages, chats (plain, with a link, with an
+image) and document uploads.
+
+Start the fake provider and the app, then run from the backend directory:
+
+    python -m benchmarks.fake_openai --port 9100 &
+    QWEN_BASE_URL=http://127.0.0.1:9100/v1 QWEN_API_KEY=fake uvicorn app.main:app --port 8000 &
+    python -m benchmarks.loadtest --users 50 --seconds 60
+
+Each virtual user loops for --seconds, picking requests by the weights in
+--mix. For chats, time to first token is the time until the first byte of
+the reply arrives. Event loop lag comes from the server's /metrics. 503s
+(admission control turning work away) are counted apart from errors.
+
+The results are written as JSON (--output). Pass --compare with an earlier
+result file to print the change and exit 1 if throughput, time to first
+token or loop lag got worse by more than --tolerance.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import subprocess
+import time
+import uuid
+from datetime import datetime, timezone
+import httpx
+
+# A 1x1 PNG; the server stores it like any uploaded image
+PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+QUESTIONS = [
+    "Explain how a hash map handles collisions.",
+    "What is the difference between a process and a thread?",
+    "Give me three tips for writing clear commit messages.",
+    "How does TCP congestion control work?",
+    "Summarize the plot of Hamlet in a few sentences.",
+]
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu".split()
+DEFAULT_MIX = "login=1,list=3,history=2,chat=6,url=1,image=1,upload=1"
+CHAT_OPS = ("chat", "url", "image")
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list] = {}
+        self.ttft: dict[str, list] = {}
+        self.errors: dict[str, int] = {}
+        self.rejected: dict[str, int] = {}
+
+    def ok(self, op: str, seconds: float, ttft: float = None):
+        self.latencies.setdefault(op, []).append(seconds)
+        if ttft is not None:
+            self.ttft.setdefault(op, []).append(ttft)
+
+    def failed(self, op: str, status: int = None):
+        counts = self.rejected if status == 503 else self.errors
+        counts[op] = counts.get(op, 0) + 1
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, account: dict, args, recorder: Recorder):
+        self.client = client
+        self.account = account
+        self.args = args
+        self.recorder = recorder
+        self.rng = random.Random()
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.account['token']}"}
+
+    async def login(self):
+        response = await self.client.post("/auth/token", data={"username": self.account["username"], "password": self.account["password"]})
+        response.raise_for_status()
+        self.account["token"] = response.json()["access_token"]
+
+    async def list(self):
+        (await self.client.get("/chat/sessions", headers=self.headers)).raise_for_status()
+
+    async def history(self):
+        response = await self.client.get(f"/chat/sessions/{self.account['session']}/messages", params={"limit": 50}, headers=self.headers)
+        response.raise_for_status()
+
+    async def _chat(self, content: str, images: list = None, model: str = "qwen-plus"):
+        """Send a message and read the reply; returns the time to its first byte."""
+        started = time.perf_counter()
+        ttft = None
+        payload = {"content": content, "model": model, "images": images or []}
+        async with self.client.stream("POST", f"/chat/sessions/{self.account['session']}/messages", json=payload, headers=self.headers) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                if ttft is None and chunk:
+                    ttft = time.perf_counter() - started
+        return ttft if ttft is not None else time.perf_counter() - started
+
+    async def chat(self):
+        return await self._chat(self.rng.choice(QUESTIONS))
+
+    async def url(self):
+        return await self._chat(f"What is this page about? {self.args.page_url}/{self.rng.randrange(1000)}")
+
+    async def image(self):
+        data_uri = "data:image/png;base64," + base64.b64encode(PIXEL_PNG).decode()
+        return await self._chat("What is in this picture?", images=[data_uri], model=self.args.vision_model)
+
+    async def upload(self):
+        # Fresh text each time, so the extraction cache does not answer for us
+        text = " ".join(self.rng.choice(WORDS) for _ in range(3000))
+        files = {"file": (f"notes-{uuid.uuid4().hex[:8]}.txt", text.encode(), "text/plain")}
+        (await self.client.post("/chat/upload", files=files, headers=self.headers)).raise_for_status()
+
+    async def run(self, mix: dict, deadline: float):
+        ops, weights = list(mix), list(mix.values())
+        while time.perf_counter() < deadline:
+            op = self.rng.choices(ops, weights)[0]
+            started = time.perf_counter()
+            try:
+                ttft = await getattr(self, op)()
+            except httpx.HTTPStatusError as e:
+                self.recorder.failed(op, e.response.status_code)
+                if e.response.status_code == 503:
+                    await asyncio.sleep(1.0)
+                continue
+            except httpx.HTTPError:
+                self.recorder.failed(op)
+                continue
+            self.recorder.ok(op, time.perf_counter() - started, ttft if op in CHAT_OPS else None)
+            if self.args.think_time:
+                await asyncio.sleep(self.rng.expovariate(1 / self.args.think_time))
+
+async def setup_accounts(client: httpx.AsyncClient, count: int) -> list:
+    run = uuid.uuid4().hex[:6]
+    accounts = []
+    for i in range(count):
+        account = {"username": f"load-{run}-{i}", "password": "load-test-password"}
+        for _ in range(10):
+            response = await client.post("/auth/register", json={**account, "email": f"{account['username']}@example.com"})
+            if response.status_code != 503:
+                break
+            await asyncio.sleep(1.0)
+        response.raise_for_status()
+        response = await client.post("/auth/token", data=account)
+        response.raise_for_status()
+        account["token"] = response.json()["access_token"]
+        session = await client.post("/chat/sessions", json={"title": "Load test"}, headers={"Authorization": f"Bearer {account['token']}"})
+        session.raise_for_status()
+        account["session"] = session.json()["id"]
+        accounts.append(account)
+    return accounts
+
+_SAMPLE = re.compile(r'^(\w+)(?:\{([^}]*)\})? (\S+)$')
+
+async def scrape(client: httpx.AsyncClient, metrics_url: str) -> dict:
+    """Event loop lag samples from /metrics: {"buckets": {le: count}, "sum", "count", "max"}, or {} if unavailable."""
+    try:
+        response = await client.get(metrics_url)
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return {}
+    lag = {"buckets": {}, "sum": 0.0, "count": 0, "max": 0.0}
+    for line in response.text.splitlines():
+        match = _SAMPLE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        if name == "event_loop_lag_seconds_bucket":
+            le = re.search(r'le="([^"]+)"', labels).group(1)
+            lag["buckets"][float("inf") if le == "+Inf" else float(le)] = float(value)
+        elif name == "event_loop_lag_seconds_sum":
+            lag["sum"] = float(value)
+        elif name == "event_loop_lag_seconds_count":
+            lag["count"] = float(value)
+        elif name == "event_loop_lag_max_seconds":
+            lag["max"] = float(value)
+    return lag
+
+def lag_summary(before: dict, after: dict) -> dict:
+    """Mean, p99 (bucket upper bound) and max loop lag between two scrapes, in ms."""
+    if not before or not after:
+        return {}
+    count = after["count"] - before["count"]
+    if count <= 0:
+        return {}
+    p99 = None
+    for le in sorted(after["buckets"]):
+        if after["buckets"][le] - before["buckets"].get(le, 0.0) >= count * 0.99:
+            p99 = le
+            break
+    return {
+        "samples": int(count),
+        "mean_ms": (after["sum"] - before["sum"]) / count * 1000,
+        "p99_ms": p99 * 1000 if p99 not in (None, float("inf")) else None,
+        "max_ms": after["max"] * 1000,
+    }
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    ops = {}
+    for op in sorted(set(recorder.latencies) | set(recorder.errors) | set(recorder.rejected)):
+        latencies = recorder.latencies.get(op, [])
+        ttft = recorder.ttft.get(op, [])
+        ops[op] = {
+            "count": len(latencies),
+            "errors": recorder.errors.get(op, 0),
+            "rejected": recorder.rejected.get(op, 0),
+            "throughput": len(latencies) / elapsed,
+            "p50_ms": _ms(percentile(latencies, 0.5)),
+            "p99_ms": _ms(percentile(latencies, 0.99)),
+        }
+        if ttft:
+            ops[op]["ttft_p50_ms"] = _ms(percentile(ttft, 0.5))
+            ops[op]["ttft_p99_ms"] = _ms(percentile(ttft, 0.99))
+    all_ttft = [value for op in CHAT_OPS for value in recorder.ttft.get(op, [])]
+    return {
+        "throughput": sum(op["count"] for op in ops.values()) / elapsed,
+        "errors": sum(op["errors"] for op in ops.values()),
+        "rejected": sum(op["rejected"] for op in ops.values()),
+        "ttft_p50_ms": _ms(percentile(all_ttft, 0.5)),
+        "ttft_p99_ms": _ms(percentile(all_ttft, 0.99)),
+        "ops": ops,
+    }
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+def print_report(result: dict):
+    print(f"{'op':<10}{'count':>8}{'err':>6}{'503':>6}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'ttft p50':>10}{'ttft p99':>10}")
+    for op, stats in result["ops"].items():
+        print(f"{op:<10}{stats['count']:>8}{stats['errors']:>6}{stats['rejected']:>6}{stats['throughput']:>9.2f}"
+              f"{_fmt(stats['p50_ms'])}{_fmt(stats['p99_ms'])}{_fmt(stats.get('ttft_p50_ms'))}{_fmt(stats.get('ttft_p99_ms'))}")
+    print(f"total {result['throughput']:.2f} req/s, {result['errors']} errors, {result['rejected']} rejected; "
+          f"time to first token p50 {_fmt(result['ttft_p50_ms']).strip()} ms, p99 {_fmt(result['ttft_p99_ms']).strip()} ms")
+    lag = result.get("event_loop_lag") or {}
+    if lag:
+        print(f"event loop lag mean {lag['mean_ms']:.2f} ms, p99 <= {_fmt(lag['p99_ms']).strip()} ms, max {lag['max_ms']:.2f} ms")
+
+def _fmt(value) -> str:
+    return f"{value:>10.1f}" if value is not None else f"{'-':>10}"
+
+# (path in the result, higher is better)
+COMPARED = [
+    (("throughput",), True),
+    (("ttft_p50_ms",), False),
+    (("ttft_p99_ms",), False),
+    (("event_loop_lag", "p99_ms"), False),
+    (("event_loop_lag", "max_ms"), False),
+]
+
+def compare(baseline: dict, result: dict, tolerance: float) -> bool:
+    """Print the change of the headline numbers; True if any got worse by more than tolerance."""
+    paths = list(COMPARED) + [(("ops", op, "p99_ms"), False) for op in result["ops"]]
+    regressed = False
+    print(f"\nagainst {baseline.get('git') or 'baseline'} of {baseline.get('started', '?')}:")
+    for path, higher_is_better in paths:
+        old, new = _lookup(baseline, path), _lookup(result, path)
+        if old is None or new is None or old == 0:
+            continue
+        change = (new - old) / old
+        worse = change < -tolerance if higher_is_better else change > tolerance
+        regressed |= worse
+        print(f"  {'.'.join(path):<28}{old:>12.2f}{new:>12.2f}{change:>+10.1%}{'  REGRESSION' if worse else ''}")
+    return regressed
+
+def _lookup(data: dict, path: tuple):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args) -> dict:
+    mix = parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.users + 10, max_keepalive_connections=args.users + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        print(f"registering {args.accounts} accounts...")
+        accounts = await setup_accounts(client, args.accounts)
+        recorder = Recorder()
+        users = [VirtualUser(client, dict(accounts[i % len(accounts)]), args, recorder) for i in range(args.users)]
+        metrics_url = args.base_url.split("/api/")[0] + "/metrics"
+
+        before = await scrape(client, metrics_url)
+        started = time.perf_counter()
+        deadline = started + args.seconds
+        await asyncio.gather(*(user.run(mix, deadline) for user in users))
+        elapsed = time.perf_counter() - started
+        after = await scrape(client, metrics_url)
+
+    result = summarize(recorder, elapsed)
+    result["event_loop_lag"] = lag_summary(before, after)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000/api/v1")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--accounts", type=int, default=5, help="Accounts the users share")
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weights per request kind")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds a user waits between requests")
+    parser.add_argument("--page-url", default="http://127.0.0.1:9100/page", help="Pages linked in chats; the fake provider serves them")
+    parser.add_argument("--vision-model", default="qwen-vl-max")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default=None, help="Result file; default benchmarks/results/<time>.json")
+    parser.add_argument("--compare", default=None, help="Earlier result file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative change before a regression is reported")
+    args = parser.parse_args()
+
+    result = {
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+    }
+    result.update(asyncio.run(run(args)))
+    print_report(result)
+
+    output = args.output or os.path.join(os.path.dirname(__file__), "results", f"{result['started'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"saved {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, result, args.tolerance):
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
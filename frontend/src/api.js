@@ -29,4 +29,10 @@ api.interceptors.response.use(
     }
 );
 
+// A resized copy of an image uploaded to the server; other URLs are returned unchanged
+export const resizedImage = (url, size) => {
+    if (!url || !url.includes('/uploads/') || url.includes('?')) return url;
+    return `${url}?size=${size}`;
+};
+
 export default api;
@@ -6,6 +6,7 @@ export const useChatStore = defineStore('chat', {
         sessions: [],
         currentSession: null,
         messages: [],
+        olderCursor: null,
         loading: false
     }),
     actions: {
@@ -18,13 +19,62 @@ export const useChatStore = defineStore('chat', {
             this.sessions.unshift(response.data);
             this.currentSession = response.data;
             this.messages = [];
+            this.olderCursor = null;
         },
         async loadSession(sessionId) {
-            const response = await api.get(`/chat/sessions/${sessionId}`);
-            this.currentSession = response.data;
-            this.messages = response.data.messages || [];
+            // Newest page first; older pages load as the user scrolls up
+            const [sessionRes, pageRes] = await Promise.all([
+                api.get(`/chat/sessions/${sessionId}`, { params: { include_messages: false } }),
+                api.get(`/chat/sessions/${sessionId}/messages`, { params: { limit: 50 } })
+            ]);
+            this.currentSession = sessionRes.data;
+            this.messages = pageRes.data.messages;
+            this.olderCursor = pageRes.data.before;
+
+            // A reply still being generated (e.g. after a reload): pick it up where the saved text ends
+            const last = this.messages[this.messages.length - 1];
+            if (last && last.role === 'assistant' && last.status === 'streaming') {
+                const offset = new TextEncoder().encode(last.content).length;
+                this.resumeStream(last.id, this.messages.length - 1, offset);
+            }
+        },
+        async readStream(response, msgIndex, onBytes) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                onBytes(value.length);
+                this.messages[msgIndex].content += decoder.decode(value, { stream: true });
+            }
+        },
+        async resumeStream(messageId, msgIndex, offset, attempts = 3) {
+            // offset counts the UTF-8 bytes of the reply we already have
+            for (let attempt = 0; attempt < attempts; attempt++) {
+                try {
+                    const response = await fetch(`http://localhost:8000/api/v1/chat/messages/${messageId}/stream?offset=${offset}`, {
+                        headers: { 'Authorization': `Bearer ${localStorage.getItem('token')}` }
+                    });
+                    if (!response.ok) return false;
+                    await this.readStream(response, msgIndex, (bytes) => { offset += bytes; });
+                    this.messages[msgIndex].status = response.headers.get('X-Stream-Status');
+                    return true;
+                } catch (error) {
+                    console.error('Error resuming reply:', error);
+                }
+            }
+            return false;
+        },
+        async loadOlderMessages() {
+            if (!this.currentSession || !this.olderCursor) return false;
+            const sessionId = this.currentSession.id;
+            const response = await api.get(`/chat/sessions/${sessionId}/messages`, { params: { limit: 50, before: this.olderCursor } });
+            if (!this.currentSession || this.currentSession.id !== sessionId) return false;
+            this.messages = [...response.data.messages, ...this.messages];
+            this.olderCursor = response.data.before;
+            return true;
         },
-        async sendMessage(content, model, images = [], fileContext = null) {
+        async sendMessage(content, model, images = [], documents = []) {
             if (!this.currentSession) {
                 await this.createSession();
             }
@@ -37,7 +87,10 @@ export const useChatStore = defineStore('chat', {
             }
             
             // Add user message immediately
-            let displayContent = content + (fileContext ? '\n\n[Attached Document Context]' : '');
+            let displayContent = content;
+            if (documents.length > 0) {
+                displayContent += '\n\n' + documents.map(doc => `[Document: ${doc.name}]`).join('\n');
+            }
             if (images && images.length > 0) {
                  images.forEach((img, idx) => {
                      displayContent += `\n\n![Image ${idx+1}](${img})`;
@@ -63,21 +116,26 @@ export const useChatStore = defineStore('chat', {
                         'Content-Type': 'application/json',
                         'Authorization': `Bearer ${localStorage.getItem('token')}`
                     },
-                    body: JSON.stringify({ content, model, images, file_context: fileContext })
+                    body: JSON.stringify({ content, model, images, document_ids: documents.map(doc => doc.id) })
                 });
 
-                const reader = response.body.getReader();
-                const decoder = new TextDecoder();
+                if (!response.ok) {
+                    const body = await response.json().catch(() => ({}));
+                    throw new Error(body.detail || `HTTP ${response.status}`);
+                }
 
-                while (true) {
-                    const { done, value } = await reader.read();
-                    if (done) break;
-                    const chunk = decoder.decode(value);
-                    this.messages[assistantMsgIndex].content += chunk;
+                const messageId = response.headers.get('X-Message-Id');
+                let received = 0;
+                try {
+                    await this.readStream(response, assistantMsgIndex, (bytes) => { received += bytes; });
+                } catch (error) {
+                    // Connection dropped: the server keeps generating, continue from what we have
+                    if (!messageId || !(await this.resumeStream(messageId, assistantMsgIndex, received))) throw error;
+                    if (this.messages[assistantMsgIndex].status === 'failed') throw error;
                 }
 
                 // Refresh session title (background task might have updated it)
-                const sessionRes = await api.get(`/chat/sessions/${this.currentSession.id}`);
+                const sessionRes = await api.get(`/chat/sessions/${this.currentSession.id}`, { params: { include_messages: false } });
                 if (sessionRes.data.title !== 'New Chat') {
                     this.currentSession.title = sessionRes.data.title;
                     const sessionInList = this.sessions.find(s => s.id === this.currentSession.id);
@@ -100,13 +158,21 @@ export const useChatStore = defineStore('chat', {
             }
         },
         async generateSessionSummary(sessionId) {
+            // The title is written by a background job; poll until it changes
             const response = await api.post(`/chat/sessions/${sessionId}/summary`);
+            const previous = response.data.title;
+            let title = previous;
+            for (let attempt = 0; attempt < 15 && title === previous; attempt++) {
+                await new Promise(resolve => setTimeout(resolve, 1000));
+                const sessionRes = await api.get(`/chat/sessions/${sessionId}`, { params: { include_messages: false } });
+                title = sessionRes.data.title;
+            }
             const session = this.sessions.find(s => s.id === sessionId);
             if (session) {
-                session.title = response.data.title;
+                session.title = title;
             }
             if (this.currentSession && this.currentSession.id === sessionId) {
-                this.currentSession.title = response.data.title;
+                this.currentSession.title = title;
             }
         }
     }